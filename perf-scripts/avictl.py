@@ -0,0 +1,169 @@
+import copy, json, threading, time
+from desired import changes, changed_fields
+from instrument import metrics
+from avi.sdk.avi_api import ApiSession
+
+class AviClient(object):
+    """
+    One controller session per run with a cache of objects by (type, name).
+    Lookups hit the controller once per object; creates and updates cache
+    the object the controller sends back, and failed writes and deletes
+    drop the cached entry, so a run makes few round trips for the same
+    objects. Calls that aren't lookups or writes by name go through get,
+    put and post unchanged. With plan set, ensure only logs what it would
+    change.
+    """
+    def __init__(self, ctrlr_inst_info, log, plan=False):
+        self.ctrlr_inst_info = ctrlr_inst_info
+        self.log = log
+        self.plan = plan
+        self.session = None
+        self.objects = {}
+        self.lock = threading.RLock()
+
+    @property
+    def api(self):
+        with self.lock:
+            if self.session is None:
+                info = self.ctrlr_inst_info
+                self.session = ApiSession.get_session(info['api_endpoint'],
+                    info['username'], info['password'],
+                    tenant=info.get('tenant', 'admin'))
+            return self.session
+
+    def _call(self, verb, path, *args, **kwargs):
+        """
+        Makes one controller request, recorded in the run's metrics as
+        avi.<verb> <object type>; responses of 400 and up count as errors.
+        """
+        call = 'avi.%s %s' % (verb.upper(), path.split('/')[0])
+        t0 = time.time()
+        try:
+            rsp = getattr(self.api, verb)(path, *args, **kwargs)
+        except Exception as e:
+            metrics.record(call, time.time() - t0, e)
+            raise
+        status = getattr(rsp, 'status_code', 0)
+        metrics.record(call, time.time() - t0,
+                       'HTTP %d' % status if status >= 400 else None)
+        return rsp
+
+    def get(self, path, **kwargs):
+        return self._call('get', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self._call('put', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self._call('post', path, **kwargs)
+
+    def get_object_by_name(self, obj_type, name):
+        """
+        Object of obj_type named name, None if there is none. Callers get
+        their own copy to change and write back.
+        """
+        key = (obj_type, name)
+        with self.lock:
+            if key in self.objects:
+                return copy.deepcopy(self.objects[key])
+        with metrics.timed('avi.GET %s' % obj_type):
+            obj = self.api.get_object_by_name(obj_type, name)
+        with self.lock:
+            self.objects[key] = obj
+        return copy.deepcopy(obj)
+
+    def _cache(self, obj_type, name, rsp):
+        obj = None
+        if rsp.status_code < 300:
+            try:
+                obj = json.loads(rsp.text)
+            except ValueError:
+                obj = None
+        with self.lock:
+            if obj is not None and name is not None:
+                self.objects[(obj_type, name)] = obj
+            else:
+                self.objects.pop((obj_type, name), None)
+        return copy.deepcopy(obj)
+
+    def create(self, obj_type, obj):
+        """POSTs obj, returns (response, created object or None)."""
+        rsp = self._call('post', obj_type, data=obj)
+        return rsp, self._cache(obj_type, obj.get('name'), rsp)
+
+    def update(self, obj_type, obj):
+        """PUTs obj by uuid, returns (response, updated object or None)."""
+        rsp = self._call('put', '%s/%s' % (obj_type, obj['uuid']), data=obj)
+        return rsp, self._cache(obj_type, obj.get('name'), rsp)
+
+    def patch(self, obj_type, obj, fields):
+        """
+        Replaces just fields on obj, returns (response, updated object or
+        None).
+        """
+        rsp = self._call('patch', '%s/%s' % (obj_type, obj['uuid']),
+                         data={'replace': fields})
+        return rsp, self._cache(obj_type, obj.get('name'), rsp)
+
+    def ensure(self, obj_type, desired, live, secrets=()):
+        """
+        Makes the live object match desired: creates it when live is None,
+        PATCHes only the fields that differ, and leaves it alone when
+        nothing does. secrets are fields the controller doesn't return,
+        sent on create and with any change but never compared. Returns the
+        resulting object (a placeholder for a planned create) or None if a
+        write failed.
+        """
+        name = desired.get('name', live.get('name') if live else None)
+        label = '%s %s' % (obj_type, name) if name else obj_type
+        prefix = 'plan: ' if self.plan else ''
+        if live is None:
+            self.log.info('%s%s: create' % (prefix, label))
+            if self.plan:
+                obj = copy.deepcopy(desired)
+                obj['url'] = obj['uuid'] = '<new %s>' % label
+                return obj
+            rsp, obj = self.create(obj_type, desired)
+            if obj is None:
+                self.log.warn('Error creating %s status %d %s' % (label,
+                              rsp.status_code, rsp.text))
+            return obj
+        compare = dict((k, v) for k, v in desired.items() if k not in secrets)
+        diffs = changes(compare, live)
+        if not diffs:
+            self.log.info('%s%s: unchanged' % (prefix, label))
+            return live
+        for field, have, want in diffs:
+            self.log.info('%s%s: %s %s -> %s' % (prefix, label, field,
+                          json.dumps(have, sort_keys=True),
+                          json.dumps(want, sort_keys=True)))
+        fields = changed_fields(compare, live)
+        for k in secrets:
+            if k in desired:
+                fields[k] = desired[k]
+        if self.plan:
+            obj = copy.deepcopy(live)
+            obj.update(fields)
+            return obj
+        rsp, obj = self.patch(obj_type, live, fields)
+        if obj is None:
+            self.log.warn('Error updating %s status %d %s' % (label,
+                          rsp.status_code, rsp.text))
+        return obj
+
+    def delete_by_name(self, obj_type, name):
+        with self.lock:
+            self.objects.pop((obj_type, name), None)
+        with metrics.timed('avi.DELETE %s' % obj_type):
+            return self.api.delete_by_name(obj_type, name)
+
+    def invalidate(self, obj_type=None, name=None):
+        """Drops one cached object, all of a type, or everything."""
+        with self.lock:
+            if obj_type is None:
+                self.objects.clear()
+            elif name is not None:
+                self.objects.pop((obj_type, name), None)
+            else:
+                for key in [k for k in self.objects if k[0] == obj_type]:
+                    del self.objects[key]
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+
+"""
+Times the gcp.py controller workflows against fakeavi.FakeAvi, with the
+instances they need from fakegcp.FakeCompute. Every workflow runs as its
+own perf_init action would, with a fresh controller session, and is
+timed and its requests counted by verb and object type. -o saves the
+results as JSON; --baseline compares them with an earlier run's and flags
+workflows that got slower or make more requests, exiting non-zero if any
+did.
+"""
+import logging, sys, argparse, json, os, shutil, subprocess, tempfile, time
+from avi.sdk.avi_api import ApiSession
+from fakeavi import FakeAvi
+from fakegcp import FakeCompute
+from gcp import gcp
+
+SSH_KEY = 'ssh-rsa AAAAB3NzaC1yc2E bench@bench'
+
+WORKFLOWS = ['create_cloud', 'create_ses', 'create_vs', 'create_vs_again',
+             'delete_vs', 'delete_cloud']
+
+def config(args, home, endpoint, num_ses):
+    inst = {'project': 'bench', 'zone': 'us-central1-b',
+            'subnet': 'regions/us-central1/subnetworks/bench',
+            'external_access': False}
+    return {'clouddata': {
+        'ssh_username': 'bench', 'ssh_public_key': SSH_KEY,
+        'ssh_private_key': 'bench', 'prefix': 'bench-',
+        'inventory_file': os.path.join(home, 'inventory.json'),
+        'avicontroller': {'api_endpoint': endpoint, 'username': 'admin',
+            'password': 'bench', 'cloud': 'perf-cloud',
+            'ipam_subnet': '10.200.0.0/24', 'ipam_start': '10.200.0.10',
+            'vip': '10.200.0.10', 'port': 80,
+            'placement_subnet': '10.0.0.0/16'},
+        'avise': dict(inst, instances=num_ses),
+        'pool': dict(inst, instances=args.pool),
+        'client': dict(inst)}}
+
+def run_workflow(name, cloud, log, compute):
+    # a new gcp and controller session per workflow, as per perf_init run
+    ApiSession.clear_cached_sessions()
+    g = gcp(cloud, log, compute=compute)
+    compute.hook = g._compute_execute
+    cd = cloud['clouddata']
+    try:
+        if name == 'create_cloud':
+            g.create_cloud(cd['avicontroller'], cd['avise'], cd['ssh_username'],
+                           cd['ssh_public_key'], cd['ssh_private_key'])
+        elif name == 'create_ses':
+            g.create_ses(cd['avise'], cd['avicontroller'], 'bench-avise-',
+                         cd['avise']['instances'], cd['ssh_username'],
+                         cd['ssh_public_key'], cd['ssh_private_key'])
+        elif name in ('create_vs', 'create_vs_again'):
+            g.create_vs(cd['avicontroller'], cd['pool'], 'bench-pool-',
+                        cd['pool']['instances'])
+        elif name == 'delete_vs':
+            g.delete_vs(cd['avicontroller'], cd['pool'])
+        elif name == 'delete_cloud':
+            g.delete_cloud(cd['avicontroller'], cd['ssh_username'])
+    finally:
+        g.close()
+
+def bench(num_ses, args, home, log):
+    fake = FakeAvi(latency=args.latency, se_delay=args.se_delay).start()
+    compute = FakeCompute(op_delay=0.1)
+    cloud = config(args, home, fake.endpoint, num_ses)
+    results = []
+    try:
+        # pool instances for create_vs, not timed
+        g = gcp(cloud, log, compute=compute)
+        compute.hook = g._compute_execute
+        g._create_instances_sync(cloud['clouddata']['pool'], 'bench-pool-',
+                                 args.pool, 'bench', SSH_KEY)
+        for name in WORKFLOWS:
+            fake.reset_counts()
+            t0 = time.time()
+            run_workflow(name, cloud, log, compute)
+            took = time.time() - t0
+            counts = dict(fake.reset_counts())
+            results.append({'workflow': name, 'ses': num_ses,
+                            'seconds': took, 'counts': counts,
+                            'requests': sum(counts.values())})
+    finally:
+        fake.stop()
+    return results
+
+def compare(results, baseline, tolerance):
+    """Lines flagging workflows slower or chattier than in baseline."""
+    before = dict(((r['workflow'], r['ses']), r) for r in baseline['results'])
+    flags = []
+    for r in results:
+        b = before.get((r['workflow'], r['ses']))
+        if b is None:
+            continue
+        if r['seconds'] > b['seconds'] * (1 + tolerance) and \
+                r['seconds'] - b['seconds'] > 0.5:
+            flags.append('%s with %d SEs took %.2fs, was %.2fs' %
+                         (r['workflow'], r['ses'], r['seconds'], b['seconds']))
+        for k in sorted(set(r['counts']) | set(b['counts'])):
+            now, was = r['counts'].get(k, 0), b['counts'].get(k, 0)
+            if now > was:
+                flags.append('%s with %d SEs makes %d %s requests, was %d' %
+                             (r['workflow'], r['ses'], now, k, was))
+    return flags
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short',
+            'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, 'w')).strip()
+    except Exception:
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Avi controller workflow benchmark')
+    parser.add_argument('--ses', '-n', action='store', default='4,40',
+                        help='comma separated SE counts')
+    parser.add_argument('--pool', action='store', type=int, default=4,
+                        help='pool instances')
+    parser.add_argument('--latency', action='store', type=float, default=0.01,
+                        help='seconds each controller request takes')
+    parser.add_argument('--se-delay', action='store', type=float, default=5.0,
+                        help='seconds until a new SE is up')
+    parser.add_argument('--output', '-o', action='store',
+                        help='save the results as JSON')
+    parser.add_argument('--baseline', '-b', action='store',
+                        help='results JSON of an earlier run to compare with')
+    parser.add_argument('--tolerance', action='store', type=float, default=0.2,
+                        help='fraction a workflow may slow down before it is flagged')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='log what gcp.py logs')
+    args = parser.parse_args()
+
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(ch)
+    logging.getLogger('avi').addHandler(ch)
+
+    # gcp keeps its key, image cache and inventory under ~
+    home = tempfile.mkdtemp(prefix='bench-avi-')
+    os.environ['HOME'] = home
+    results = []
+    try:
+        for n in [int(s) for s in args.ses.split(',')]:
+            for r in bench(n, args, home, logger):
+                results.append(r)
+                print('%-16s %4d SEs %8.2fs %5d requests  %s' % (r['workflow'],
+                      r['ses'], r['seconds'], r['requests'],
+                      ' '.join('%s=%d' % (k.replace(' ', ':'), v) for k, v in
+                               sorted(r['counts'].items()))))
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+    run = {'commit': git_commit(), 'params': vars(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        flags = compare(results, baseline, args.tolerance)
+        for line in flags:
+            print('REGRESSION %s' % line)
+        print('%d regressions against %s (commit %s)' % (len(flags),
+              args.baseline, baseline.get('commit')))
+        sys.exit(1 if flags else 0)
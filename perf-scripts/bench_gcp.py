@@ -0,0 +1,110 @@
+#!/usr/bin/python
+
+"""
+Times gcp.py provisioning against fakegcp.FakeCompute: creating instances
+one insert at a time (_create_instances_sync) and in batches
+(_create_instances_async), listing and deleting them, at each fleet size.
+Logs wall time and Compute API calls by method for every step, and saves
+them as JSON with -o. Requests go through gcp's rate limiter as they do
+against the real API, starting at --api-rate.
+"""
+import logging, sys, argparse, json, os, shutil, tempfile, time
+from fakegcp import FakeCompute
+from gcp import gcp
+
+PREFIX = 'bench-client-'
+SSH_KEY = 'ssh-rsa AAAAB3NzaC1yc2E bench@bench'
+
+def bench_step(results, name, n, fake, fn):
+    calls = fake.calls.copy()
+    rate_limited = fake.rate_limited
+    t0 = time.time()
+    out = fn()
+    took = time.time() - t0
+    calls = dict((k, v - calls.get(k, 0)) for k, v in fake.calls.items()
+                 if v != calls.get(k, 0))
+    results.append({'step': name, 'instances': n, 'seconds': took,
+                    'api_calls': sum(calls.values()), 'calls': calls,
+                    'rate_limited': fake.rate_limited - rate_limited,
+                    'result': len(out) if out is not None else 0})
+    return results[-1]
+
+def bench_size(n, args, home, log):
+    """Runs every step on a fleet of n against a fresh fake."""
+    fake = FakeCompute(latency=args.latency, op_delay=args.op_delay,
+                       rate_limit=args.rate_limit, page_size=args.page_size)
+    cloud = {'clouddata': {'ssh_username': 'bench',
+                           'ssh_private_key': 'bench',
+                           'api_rate': args.api_rate,
+                           'inventory_file': os.path.join(home,
+                                                          'inventory.json')}}
+    inst_info = {'project': 'bench', 'zone': 'us-central1-b',
+                 'subnet': 'regions/us-central1/subnetworks/bench',
+                 'external_access': False,
+                 'batch_size': args.batch_size,
+                 'batch_concurrency': args.batch_concurrency}
+    g = gcp(cloud, log, compute=fake)
+    fake.hook = g._compute_execute
+    results = []
+    try:
+        bench_step(results, 'create_sync', n, fake, lambda:
+            g._create_instances_sync(inst_info, PREFIX, n, 'bench', SSH_KEY))
+        bench_step(results, 'list', n, fake, lambda:
+            g.list_instances(inst_info, PREFIX))
+        bench_step(results, 'delete', n, fake, lambda:
+            g.delete_instances(inst_info, PREFIX, wait=True))
+        bench_step(results, 'create_async', n, fake, lambda:
+            g._create_instances_async(inst_info, PREFIX, n, 'bench', SSH_KEY))
+    finally:
+        g.close()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='gcp.py provisioning benchmark')
+    parser.add_argument('--sizes', '-n', action='store', default='10,100,1000',
+                        help='comma separated fleet sizes')
+    parser.add_argument('--latency', action='store', type=float, default=0.02,
+                        help='seconds each API call takes')
+    parser.add_argument('--op-delay', action='store', type=float, default=2.0,
+                        help='seconds until an operation is DONE')
+    parser.add_argument('--rate-limit', action='store', type=float, default=0,
+                        help='API calls per second before rateLimitExceeded, 0 for no limit')
+    parser.add_argument('--api-rate', action='store', type=float, default=20,
+                        help='requests per second the rate limiter starts at')
+    parser.add_argument('--page-size', action='store', type=int, default=500,
+                        help='max instances per list page')
+    parser.add_argument('--batch-size', action='store', type=int, default=500)
+    parser.add_argument('--batch-concurrency', action='store', type=int,
+                        default=4)
+    parser.add_argument('--output', '-o', action='store',
+                        help='save the results as JSON')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='log what gcp.py logs')
+    args = parser.parse_args()
+
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(ch)
+
+    # gcp keeps its key, image cache and inventory under ~
+    home = tempfile.mkdtemp(prefix='bench-gcp-')
+    os.environ['HOME'] = home
+    results = []
+    try:
+        for n in [int(s) for s in args.sizes.split(',')]:
+            for r in bench_size(n, args, home, logger):
+                results.append(r)
+                print('%-12s %6d %8.2fs %7d calls %5d rate limited %6d result  %s' %
+                      (r['step'], r['instances'], r['seconds'], r['api_calls'],
+                       r['rate_limited'], r['result'],
+                       ' '.join('%s=%d' % kv for kv in sorted(r['calls'].items()))))
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'params': vars(args), 'results': results}, f, indent=2,
+                      sort_keys=True)
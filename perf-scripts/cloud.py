@@ -3,6 +3,9 @@ class Cloud(object):
         self.log = log
         self.cloud = cloud
 
+    def close(self):
+        pass
+
     def create_instance(self, name, inst_info, ssh_user, ssh_key, wait=False):
         pass
 
@@ -14,6 +17,10 @@ class Cloud(object):
                                                       ssh_key):
         return 0
 
+    def create_se_instances(self, se_inst_info, prefix, num_instances,
+                            ssh_username, ssh_public_key):
+        return []
+
     def create_ses(self, se_inst_info, ctrlr_inst_info, prefix, num_instances, 
                    ssh_username, ssh_public_key, ssh_private_key):
         return 0
@@ -24,6 +31,12 @@ class Cloud(object):
     def stop_test(self, inst_info, prefix):
         return
 
+    def watch_test(self, inst_info, prefix, duration=0):
+        return
+
+    def find_peak(self, inst_info, vip, prefix):
+        return
+
     def delete_ses(self, se_inst_info, ctrlr_inst_info, prefix):
         return 0
 
@@ -33,12 +46,15 @@ class Cloud(object):
     def delete_instances(self, inst_info, prefix, wait=False):
         pass
 
-    def list_instances(self, inst_info):
-        pass
+    def list_instances(self, inst_info, prefix=None, status='RUNNING'):
+        return []
 
     def wait_for_operation(self, inst_info, op):
         pass
 
+    def wait_for_operations(self, zone, project, operations):
+        return {}
+
     def create_vs(self, ctrlr_inst_info, pool_inst_info, pool_prefix, 
                   n_pool_instances):
         pass
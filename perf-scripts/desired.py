@@ -0,0 +1,70 @@
+"""
+Field by field comparison of desired controller objects with live ones.
+A desired object only holds the fields this tool manages; anything else
+on the live object is left alone. Refs compare by the uuid they point to,
+lists compare without regard to order, and list entries only on the
+fields the desired entries set, since the controller fills in defaults.
+"""
+import copy, json
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+def _ref_uuid(ref):
+    # https://ctrl/api/network/network-1234#perf-network
+    if isinstance(ref, string_types):
+        return ref.split('#')[0].rstrip('/').rsplit('/', 1)[-1]
+    return ref
+
+def _project(have, want):
+    """have cut down to the shape of want."""
+    if isinstance(want, dict) and isinstance(have, dict):
+        return dict((k, _project(have.get(k), v)) for k, v in want.items())
+    if isinstance(want, list) and isinstance(have, list) and want and \
+            all(isinstance(w, dict) for w in want):
+        template = {}
+        for w in want:
+            template.update(w)
+        return [_project(h, template) for h in have]
+    return have
+
+def _norm(value, key=''):
+    if key.endswith('_ref'):
+        return _ref_uuid(value)
+    if key.endswith('_refs') and isinstance(value, list):
+        return sorted(_ref_uuid(v) for v in value)
+    if isinstance(value, dict):
+        return dict((k, _norm(v, k)) for k, v in value.items()
+                    if v is not None)
+    if isinstance(value, list):
+        return sorted((_norm(v, key) for v in value),
+                      key=lambda v: json.dumps(v, sort_keys=True))
+    return value
+
+def changes(desired, live, path=''):
+    """[(field path, live value, desired value)] for fields that differ."""
+    out = []
+    for key in sorted(desired):
+        want = desired[key]
+        have = live.get(key) if isinstance(live, dict) else None
+        if isinstance(want, dict) and isinstance(have, dict):
+            out.extend(changes(want, have, '%s%s.' % (path, key)))
+        elif _norm(want, key) != _norm(_project(have, want), key):
+            out.append(('%s%s' % (path, key), have, want))
+    return out
+
+def merge(desired, live):
+    """live with the desired fields set, nested dicts merged."""
+    if not isinstance(desired, dict) or not isinstance(live, dict):
+        return copy.deepcopy(desired)
+    merged = copy.deepcopy(live)
+    for key, want in desired.items():
+        merged[key] = merge(want, live.get(key))
+    return merged
+
+def changed_fields(desired, live):
+    """Top level fields to send in a PATCH replace, merged with live."""
+    keys = set(c[0].split('.')[0] for c in changes(desired, live))
+    return dict((k, merge(desired[k], live.get(k))) for k in keys)
@@ -0,0 +1,278 @@
+#!/usr/bin/python
+
+"""
+Local HTTP stand-in for the Avi controller REST objects gcp.py manages, so
+the controller workflows can be timed without a controller. avisdk talks
+to it as to a real one: it logs in through /login, gets session and CSRF
+cookies, and the /api/<type> collections page their results and take name
+and fields filters. Objects refer to each other by url, and an object that
+is still referred to can't be deleted. Adding hosts to a Linux server
+cloud brings up one SE per host, OPER_UP se_delay seconds later; removing
+them takes the SEs away after the same delay. Every request waits latency
+seconds and is counted by verb and object type in counts.
+"""
+import collections, copy, json, threading, time, uuid
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+VERSION = '17.2.16'
+
+# Object types with a single instance, read and written without a uuid
+SINGLETONS = {'seproperties': 'default'}
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _handle(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        cookies = {}
+        for c in (self.headers.get('Cookie') or '').split(';'):
+            if '=' in c:
+                k, v = c.strip().split('=', 1)
+                cookies[k] = v
+        status, obj, headers = self.server.fake.handle(self.command,
+            url.path, parse_qs(url.query), body, cookies)
+        data = json.dumps(obj).encode('utf-8') if obj is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in headers:
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+    def log_message(self, *args):
+        pass
+
+class FakeAvi(object):
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, se_delay=5.0,
+                 page_size=25, max_page_size=200):
+        self.latency = latency
+        self.se_delay = se_delay
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.lock = threading.RLock()
+        self.objects = collections.defaultdict(dict)
+        self.counts = collections.Counter()
+        self.sessions = set()
+        # (when, fn) side effects that haven't happened yet
+        self.scheduled = []
+        self.server = _Server((host, port), _Handler)
+        self.server.fake = self
+        self.thread = None
+        self.endpoint = 'http://%s:%d' % self.server.server_address
+        self._seed()
+
+    def _seed(self):
+        # What a freshly set up controller has
+        self._create('seproperties', {'se_runtime_properties':
+            {'global_mtu': 1500, 'se_handle_interface_routes': False}})
+        self._create('cloud', {'name': 'Default-Cloud',
+                               'vtype': 'CLOUD_NONE'})
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name='fakeavi')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counts(self):
+        with self.lock:
+            counts = self.counts.copy()
+            self.counts.clear()
+        return counts
+
+    def _url(self, obj_type, obj_uuid):
+        return '%s/api/%s/%s' % (self.endpoint, obj_type, obj_uuid)
+
+    def _create(self, obj_type, obj):
+        obj = copy.deepcopy(obj)
+        obj['uuid'] = SINGLETONS.get(obj_type) or '%s-%s' % (obj_type,
+                                                             uuid.uuid4())
+        obj['url'] = self._url(obj_type, obj['uuid'])
+        obj['_last_modified'] = str(int(time.time() * 1e6))
+        self.objects[obj_type][obj['uuid']] = obj
+        self._changed(obj_type, None, obj)
+        return obj
+
+    def _update(self, obj_type, old, new):
+        new = copy.deepcopy(new)
+        new['uuid'] = old['uuid']
+        new['url'] = old['url']
+        new['_last_modified'] = str(int(time.time() * 1e6))
+        self.objects[obj_type][old['uuid']] = new
+        self._changed(obj_type, old, new)
+        return new
+
+    def _by_name(self, obj_type, name):
+        for obj in self.objects[obj_type].values():
+            if obj.get('name') == name:
+                return obj
+        return None
+
+    def _changed(self, obj_type, old, new):
+        """Side effects of a write: SE groups for clouds, SEs for hosts."""
+        if obj_type != 'cloud':
+            return
+        if old is None:
+            self._create('serviceenginegroup', {'name': 'Default-Group',
+                'cloud_ref': new['url'], 'min_scaleout_per_vs': 1,
+                'max_scaleout_per_vs': 4, 'dedicated_dispatcher_core': False})
+        hosts = lambda o: set(h['host_ip']['addr'] for h in
+            ((o or {}).get('linuxserver_configuration') or {}).get('hosts',
+                                                                   []))
+        added = hosts(new) - hosts(old)
+        removed = hosts(old) - hosts(new)
+        ses = dict((se['name'].split('--se--')[0], se) for se in
+                   self.objects['serviceengine'].values()
+                   if se['cloud_ref'] == new['url'])
+        for ip in sorted(added):
+            if ip in ses:
+                continue
+            se = self._create('serviceengine', {'name': '%s--se--%s' %
+                (ip, uuid.uuid4().hex[:5]), 'cloud_ref': new['url'],
+                'oper_status': {'state': 'OPER_CREATING'}})
+            self.scheduled.append((time.time() + self.se_delay,
+                lambda se=se: se['oper_status'].update(state='OPER_UP')))
+        for ip in sorted(removed):
+            se = ses.get(ip)
+            if se is None:
+                continue
+            se['oper_status']['state'] = 'OPER_DISABLED'
+            self.scheduled.append((time.time() + self.se_delay,
+                lambda se=se: self.objects['serviceengine'].pop(se['uuid'],
+                                                                None)))
+
+    def _tick(self):
+        now = time.time()
+        due = [s for s in self.scheduled if s[0] <= now]
+        self.scheduled = [s for s in self.scheduled if s[0] > now]
+        for _, fn in due:
+            fn()
+
+    def _referred_by(self, obj):
+        for obj_type, objs in self.objects.items():
+            for other in objs.values():
+                if other is not obj and \
+                        obj['url'] in json.dumps(other, sort_keys=True):
+                    return '%s %s' % (obj_type, other.get('name',
+                                                          other['uuid']))
+        return None
+
+    def _list(self, obj_type, query):
+        objs = sorted(self.objects[obj_type].values(),
+                      key=lambda o: o.get('name', o['uuid']))
+        if 'name' in query:
+            objs = [o for o in objs if o.get('name') == query['name'][0]]
+        page = max(1, int(query.get('page', ['1'])[0]))
+        size = min(int(query.get('page_size', [self.page_size])[0]),
+                   self.max_page_size)
+        results = objs[(page - 1) * size:page * size]
+        if 'fields' in query:
+            fields = set(query['fields'][0].split(',')) | set(['url', 'uuid'])
+            results = [dict((k, v) for k, v in o.items() if k in fields)
+                       for o in results]
+        rsp = {'count': len(objs), 'results': results}
+        if page * size < len(objs):
+            rsp['next'] = '%s/api/%s?page=%d&page_size=%d' % (self.endpoint,
+                obj_type, page + 1, size)
+        return rsp
+
+    def handle(self, method, path, query, body, cookies):
+        """(status, response object, headers) for one request."""
+        time.sleep(self.latency)
+        parts = [p for p in path.split('/') if p]
+        if parts == ['login'] and method == 'POST':
+            with self.lock:
+                self.counts['POST login'] += 1
+                session = uuid.uuid4().hex
+                self.sessions.add(session)
+            return 200, {'version': {'Version': VERSION},
+                         'session_cookie_name': 'sessionid'}, [
+                ('Set-Cookie', 'csrftoken=%s; Path=/' % uuid.uuid4().hex),
+                ('Set-Cookie', 'sessionid=%s; Path=/' % session)]
+        if len(parts) < 2 or parts[0] != 'api':
+            return 404, {'error': 'Not found'}, []
+        obj_type = parts[1]
+        obj_uuid = parts[2] if len(parts) > 2 else SINGLETONS.get(obj_type)
+        try:
+            data = json.loads(body.decode('utf-8')) if body else None
+        except ValueError:
+            return 400, {'error': 'Invalid JSON'}, []
+        with self.lock:
+            self.counts['%s %s' % (method, obj_type)] += 1
+            if cookies.get('sessionid') not in self.sessions:
+                return 401, {'error': 'Authentication credentials were not '
+                             'provided.'}, []
+            self._tick()
+            objs = self.objects[obj_type]
+            if obj_uuid is None:
+                if method == 'GET':
+                    return 200, self._list(obj_type, query), []
+                if method != 'POST':
+                    return 405, {'error': 'Method not allowed'}, []
+                if not data or 'name' not in data:
+                    return 400, {'error': 'name is required'}, []
+                if self._by_name(obj_type, data['name']):
+                    return 409, {'error': '%s with this name already '
+                                 'exists' % obj_type}, []
+                return 201, self._create(obj_type, data), []
+            obj = objs.get(obj_uuid)
+            if obj is None:
+                return 404, {'error': 'Object not found'}, []
+            if method == 'GET':
+                return 200, obj, []
+            if method == 'PUT':
+                return 200, self._update(obj_type, obj, data or {}), []
+            if method == 'PATCH':
+                new = copy.deepcopy(obj)
+                new.update((data or {}).get('replace', {}))
+                for k, v in (data or {}).get('add', {}).items():
+                    if isinstance(v, list):
+                        new[k] = new.get(k, []) + v
+                    else:
+                        new[k] = v
+                for k in (data or {}).get('delete', {}):
+                    new.pop(k, None)
+                return 200, self._update(obj_type, obj, new), []
+            if method == 'DELETE':
+                referrer = self._referred_by(obj)
+                if referrer:
+                    return 412, {'error': 'Cannot delete, object is referred '
+                                 'by: [%s]' % referrer}, []
+                del objs[obj_uuid]
+                return 204, None, []
+            return 405, {'error': 'Method not allowed'}, []
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Fake Avi controller')
+    parser.add_argument('--port', '-p', action='store', type=int, default=8080)
+    parser.add_argument('--latency', action='store', type=float, default=0.0,
+                        help='seconds each request takes')
+    parser.add_argument('--se-delay', action='store', type=float, default=5.0,
+                        help='seconds until a new SE is up')
+    args = parser.parse_args()
+    fake = FakeAvi(host='0.0.0.0', port=args.port, latency=args.latency,
+                   se_delay=args.se_delay)
+    print('Fake Avi controller on port %d, login with any user' % args.port)
+    fake.server.serve_forever()
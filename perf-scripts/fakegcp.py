@@ -0,0 +1,298 @@
+"""
+In-memory stand-in for the parts of the Compute v1 API gcp.py uses, so
+provisioning can be timed and regression tested without a project. It is
+passed to gcp as compute= in place of the discovery client and mirrors its
+shape: compute.instances().insert(...).execute(), list_next and
+new_batch_http_request. Operations finish op_delay seconds after they are
+created, instances are RUNNING (or gone) once their operation is DONE, and
+every call waits latency seconds, a batch once for the whole request.
+Calls beyond rate_limit per second fail with 403 rateLimitExceeded as the
+real quota does, and list pages hold at most page_size items. calls counts
+every API call by resource.method. hook, when set, runs every single
+request as gcp._compute_execute runs the real ones: hook(methodId, execute).
+"""
+import collections, itertools, json, re, threading, time
+import httplib2
+from googleapiclient.errors import HttpError
+
+# Sub-requests the batch endpoint accepts in one request
+MAX_BATCH = 1000
+
+# Longest zoneOperations.wait holds a request before returning the op
+WAIT_TIMEOUT = 120
+
+def _http_error(status, reason, message):
+    resp = httplib2.Response({'status': status})
+    resp.reason = reason
+    content = json.dumps({'error': {'code': status, 'message': message,
+                          'errors': [{'reason': reason,
+                                      'message': message}]}})
+    return HttpError(resp, content.encode('utf-8'))
+
+class FakeRequest(object):
+    def __init__(self, compute, method, fn, kwargs):
+        self.compute = compute
+        self.method = method
+        self.methodId = 'compute.%s' % method
+        self.fn = fn
+        self.kwargs = kwargs
+
+    def _call(self):
+        self.compute._count(self.method)
+        return self.fn(**self.kwargs)
+
+    def execute(self, http=None, num_retries=0):
+        def run():
+            time.sleep(self.compute.latency)
+            return self._call()
+        if self.compute.hook is None:
+            return run()
+        return self.compute.hook(self.methodId, run)
+
+class FakeBatch(object):
+    def __init__(self, compute, callback=None):
+        self.compute = compute
+        self.callback = callback
+        self.requests = []
+        self.ids = itertools.count()
+
+    def add(self, request, callback=None, request_id=None):
+        if request_id is None:
+            request_id = str(next(self.ids))
+        self.requests.append((request_id, request, callback))
+
+    def execute(self, http=None):
+        self.compute._count('batch')
+        time.sleep(self.compute.latency)
+        if len(self.requests) > MAX_BATCH:
+            raise _http_error(400, 'badRequest', 'Too many requests in batch')
+        for request_id, request, callback in self.requests:
+            response = exception = None
+            try:
+                response = request._call()
+            except HttpError as e:
+                exception = e
+            for cb in (callback, self.callback):
+                if cb:
+                    cb(request_id, response, exception)
+
+class _Resource(object):
+    def __init__(self, compute, name):
+        self.compute = compute
+        self.name = name
+
+    def __getattr__(self, method):
+        fn = getattr(self.compute, '_%s_%s' % (self.name, method), None)
+        if fn is None:
+            raise AttributeError(method)
+        label = '%s.%s' % (self.name, method)
+        if method == 'list_next':
+            return fn
+        return lambda **kwargs: FakeRequest(self.compute, label, fn, kwargs)
+
+class FakeCompute(object):
+    def __init__(self, latency=0.0, op_delay=1.0, rate_limit=0,
+                 rate_burst=None, page_size=500, wait_timeout=WAIT_TIMEOUT):
+        self.latency = latency
+        self.op_delay = op_delay
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst or rate_limit
+        self.page_size = page_size
+        self.wait_timeout = wait_timeout
+        self.tokens = self.rate_burst
+        self.refilled = time.time()
+        self.lock = threading.RLock()
+        self.instances_by_name = {}
+        self.operations = {}
+        self.calls = collections.Counter()
+        self.rate_limited = 0
+        self.hook = None
+        self.op_ids = itertools.count(1)
+        self.ips = itertools.count(2)
+
+    def instances(self):
+        return _Resource(self, 'instances')
+
+    def images(self):
+        return _Resource(self, 'images')
+
+    def zoneOperations(self):
+        return _Resource(self, 'zoneOperations')
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def _count(self, method):
+        with self.lock:
+            self.calls[method] += 1
+            if not self.rate_limit:
+                return
+            now = time.time()
+            self.tokens = min(self.rate_burst, self.tokens +
+                              (now - self.refilled) * self.rate_limit)
+            self.refilled = now
+            if self.tokens < 1:
+                self.rate_limited += 1
+                raise _http_error(403, 'rateLimitExceeded',
+                                  'Rate Limit Exceeded')
+            self.tokens -= 1
+
+    def _operation(self, zone, op_type, target, done):
+        """Starts an operation that runs done() when it finishes."""
+        with self.lock:
+            name = 'operation-%d' % next(self.op_ids)
+            op = {'kind': 'compute#operation', 'name': name, 'zone': zone,
+                  'operationType': op_type, 'targetLink': target,
+                  'status': 'RUNNING', 'progress': 0}
+            self.operations[name] = (op, time.time() + self.op_delay, done)
+            return dict(op)
+
+    def _tick(self):
+        now = time.time()
+        with self.lock:
+            for name, (op, done_at, done) in self.operations.items():
+                if op['status'] != 'DONE' and done_at <= now:
+                    error = done()
+                    op['status'] = 'DONE'
+                    op['progress'] = 100
+                    if error:
+                        op['error'] = {'errors': [error]}
+
+    def _instance(self, name):
+        inst = self.instances_by_name.get(name)
+        if inst is None:
+            raise _http_error(404, 'notFound', "The resource '%s' was not "
+                              'found' % name)
+        return inst
+
+    # images
+
+    def _images_get(self, project, image):
+        return {'name': image, 'selfLink': 'projects/%s/global/images/%s' %
+                (project, image)}
+
+    def _images_getFromFamily(self, project, family):
+        return {'name': '%s-v1' % family, 'family': family,
+                'selfLink': 'projects/%s/global/images/%s-v1' %
+                (project, family)}
+
+    # instances
+
+    def _insert(self, zone, name, config):
+        def done():
+            with self.lock:
+                self.instances_by_name[name]['status'] = 'RUNNING'
+        with self.lock:
+            if name in self.instances_by_name:
+                raise _http_error(409, 'alreadyExists', "The resource '%s' "
+                                  'already exists' % name)
+            ip = next(self.ips)
+            inst = dict(config, name=name, zone=zone, status='PROVISIONING')
+            inst['networkInterfaces'] = [dict(nic) for nic in
+                config.get('networkInterfaces', [{}])]
+            inst['networkInterfaces'][0]['networkIP'] = '10.%d.%d.%d' % (
+                ip >> 16 & 255, ip >> 8 & 255, ip & 255)
+            inst['metadata'] = dict(config.get('metadata', {}),
+                                    fingerprint='fp-%d' % ip)
+            self.instances_by_name[name] = inst
+            return self._operation(zone, 'insert', name, done)
+
+    def _instances_insert(self, project, zone, body):
+        return self._insert(zone, body['name'], body)
+
+    def _instances_bulkInsert(self, project, zone, body):
+        names = sorted(body['perInstanceProperties'])
+        with self.lock:
+            for name in names:
+                self._insert(zone, name, dict(body['instanceProperties'],
+                                              name=name))
+            return self._operation(zone, 'bulkInsert', names[0],
+                                   lambda: None)
+
+    def _instances_get(self, project, zone, instance):
+        self._tick()
+        with self.lock:
+            return json.loads(json.dumps(self._instance(instance)))
+
+    def _instances_setMetadata(self, project, zone, instance, body):
+        with self.lock:
+            inst = self._instance(instance)
+            if body.get('fingerprint') != inst['metadata']['fingerprint']:
+                raise _http_error(412, 'conditionNotMet', 'Supplied '
+                                  'fingerprint does not match current '
+                                  'metadata fingerprint')
+            inst['metadata'] = dict(body, fingerprint='%s+' %
+                                    body['fingerprint'])
+            return self._operation(zone, 'setMetadata', instance, lambda: None)
+
+    def _instances_delete(self, project, zone, instance):
+        def done():
+            with self.lock:
+                self.instances_by_name.pop(instance, None)
+        with self.lock:
+            inst = self._instance(instance)
+            inst['status'] = 'STOPPING'
+            return self._operation(zone, 'delete', instance, done)
+
+    def _page(self, resources, filter, maxResults, pageToken):
+        """One list page of {name: resource} matching filter."""
+        # (name eq "re") (status ne "DONE"), each RE2 matching the field
+        matchers = [(f, op == 'eq', re.compile('(?:%s)$' % v)) for f, op, v in
+                    re.findall(r'\((\w+) (eq|ne) "([^"]*)"\)', filter or '')]
+        names = sorted(n for n, r in resources.items()
+                       if all(bool(m.match(str(r.get(f, '')))) == eq
+                              for f, eq, m in matchers))
+        start = int(pageToken or 0)
+        size = min(maxResults or 500, self.page_size)
+        page = {'items': [json.loads(json.dumps(resources[n]))
+                          for n in names[start:start + size]]}
+        if start + size < len(names):
+            page['nextPageToken'] = str(start + size)
+        return page
+
+    def _instances_list(self, project, zone, filter=None, maxResults=500,
+                        fields=None, pageToken=None):
+        self._tick()
+        with self.lock:
+            return self._page(self.instances_by_name, filter, maxResults,
+                              pageToken)
+
+    def _instances_list_next(self, previous_request, previous_response):
+        token = previous_response.get('nextPageToken')
+        if not token:
+            return None
+        return FakeRequest(self, 'instances.list', self._instances_list,
+                           dict(previous_request.kwargs, pageToken=token))
+
+    # zoneOperations
+
+    def _zoneOperations_get(self, project, zone, operation):
+        self._tick()
+        with self.lock:
+            if operation not in self.operations:
+                raise _http_error(404, 'notFound', "The resource '%s' was "
+                                  'not found' % operation)
+            return dict(self.operations[operation][0])
+
+    def _zoneOperations_list(self, project, zone, filter=None,
+                             maxResults=500, fields=None, pageToken=None):
+        self._tick()
+        with self.lock:
+            return self._page(dict((n, o[0]) for n, o in
+                                   self.operations.items()), filter,
+                              maxResults, pageToken)
+
+    def _zoneOperations_list_next(self, previous_request, previous_response):
+        token = previous_response.get('nextPageToken')
+        if not token:
+            return None
+        return FakeRequest(self, 'zoneOperations.list',
+                           self._zoneOperations_list,
+                           dict(previous_request.kwargs, pageToken=token))
+
+    def _zoneOperations_wait(self, project, zone, operation):
+        with self.lock:
+            done_at = self.operations[operation][1] \
+                if operation in self.operations else 0
+        time.sleep(max(0, min(done_at - time.time(), self.wait_timeout)))
+        return self._zoneOperations_get(project, zone, operation)
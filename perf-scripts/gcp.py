@@ -1,109 +1,399 @@
-import time, traceback, json, httplib2
+import time, traceback, json, httplib, httplib2, re, random, threading, socket
 from cloud import Cloud
+from inventory import Inventory
+from results import OUTPUT_SEPARATOR, merge_results, format_results
+from watch import StatsAggregator, window_rates
+from profiles import expand_profile, format_curve, client_rates
+from peak import find_peak, slo_violation
+from loadgen import get_driver
 from oauth2client.client import GoogleCredentials
 from googleapiclient import discovery
-from avi.sdk.avi_api import ApiSession
+from googleapiclient.http import HttpRequest
+from multiprocessing.pool import ThreadPool
+from avictl import AviClient
+from sshexec import SSHExecutor
+from instrument import metrics
+from ratelimit import RateLimiter
+import io, os, pipes, tarfile
+
+# Where each load generator process on a client writes its output
+LOAD_RESULTS_DIR = '/tmp/load-results'
+
+# Stats agent shipped to clients for watchtest
+STATS_AGENT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'statsagent.py')
+
+# Max requests in a single Compute API batch request
+MAX_BATCH_REQUESTS = 500
+
+# Defaults for batch submission: batches in flight at once, retries of
+# failed sub-requests and the backoff base in seconds
+BATCH_CONCURRENCY = 4
+BATCH_RETRIES = 5
+BATCH_BACKOFF = 2
+
+# Max instances created by a single bulkInsert request
+MAX_BULK_INSTANCES = 1000
+
+# Page size for instances().list, 500 is the API maximum
+LIST_PAGE_SIZE = 500
+
+# Objects per page when listing from the Avi controller
+AVI_PAGE_SIZE = 200
+
+# SE readiness poll interval and default deadline, in seconds
+SE_POLL_INTERVAL = 5
+SE_READY_TIMEOUT = 600
+
+# Retries of hosts a package install failed on, and the marker install
+# tasks print on hosts that already have everything
+INSTALL_RETRIES = 2
+INSTALLED = 'already-installed'
+
+# Compute API requests/sec to start at, the default per project quota, and
+# times a request turned away by the rate limit is sent again
+API_RATE = 20
+RATE_LIMIT_RETRIES = 5
+
+# Operation poll interval bounds and overall timeout, in seconds
+OP_POLL_MIN = 1
+OP_POLL_MAX = 16
+OP_TIMEOUT = 600
+
+# Remote tasks: each returns the shell command _run_task runs on every host,
+# or (command, stdin) when files are sent along as a tar stream on stdin
+
+def _sudo(cmd):
+    return 'sudo -n sh -c %s' % pipes.quote(cmd)
+
+def _tar(files):
+    """tar stream of files, each under its base name."""
+    buf = io.BytesIO()
+    tar = tarfile.open(fileobj=buf, mode='w')
+    for f in files:
+        tar.add(f, arcname=os.path.basename(f))
+    tar.close()
+    return buf.getvalue()
+
+def install_load_task(install_cmd, image_family='centos', check_cmd=None):
+    if 'centos' not in image_family:
+        return 'true'
+    if not check_cmd:
+        return _sudo(install_cmd)
+    return 'if %s > /dev/null 2>&1; then echo %s; else %s; fi' % (check_cmd,
+        INSTALLED, _sudo(install_cmd))
 
-from fabric.api import env as fabric_env
-from fabric.api import task, sudo, execute, run
-
-from fabric.context_managers import settings
-from fabric.state import output as fabric_output
-import os
-
-@task
-def install_ab_task(image_family='centos'):
-    if 'centos' in image_family:
-        sudo('yum install -y httpd-tools psmisc')
-
-@task
 def install_docker_task(image_family='centos'):
     if 'centos' in image_family:
-        res = sudo('yum install -y docker')
-        sudo('systemctl start docker')
-        sudo('systemctl enable docker')
-    return res
+        return _sudo('yum install -y docker && systemctl start docker && '
+                     'systemctl enable docker')
+    return 'true'
 
-@task
 def start_avinetworks_server():
-    sudo('docker run -d -p 80:80 avinetworks/server')
-
-@task
-def start_ab(vip, n):
-    run('killall ab')
-    for i in xrange(0, n):
-        run('nohup ab -r -c 100 -n 100000000 https://%s/ >& /dev/null < '
-            '/dev/null &' % vip, pty=False)
-
-@task
-def stop_ab():
-    run('killall ab')
-
-class FabricException(Exception):
-    pass
+    return _sudo('docker run -d -p 80:80 avinetworks/server')
+
+def upload_files(files):
+    return ('tar -xf - -C /tmp', _tar(files))
+
+def start_load(cmds):
+    return 'mkdir -p %s; rm -f %s/*.log; %s' % (LOAD_RESULTS_DIR,
+        LOAD_RESULTS_DIR, ' '.join('nohup %s > %s/%d.log 2>&1 < /dev/null &' %
+        (cmd, LOAD_RESULTS_DIR, i) for i, cmd in enumerate(cmds)))
+
+def stop_load(stop_cmd):
+    # nothing left to stop isn't a failure
+    return '%s; true' % stop_cmd
+
+def collect_load_results():
+    return ('for f in %s/*.log; do [ -e "$f" ] || continue; echo "%s$f"; '
+            'cat "$f"; done' % (LOAD_RESULTS_DIR, OUTPUT_SEPARATOR))
+
+def start_stats_agent(collector, duration, procs):
+    # [s] keeps pkill from matching the shell running this command
+    return ('tar -xf - -C /tmp; pkill -f "[s]tatsagent.py"; nohup python '
+            '/tmp/statsagent.py --collector %s --duration %d --procs %s '
+            '> /dev/null 2>&1 < /dev/null &' % (collector, duration, procs),
+            _tar([STATS_AGENT]))
+
+def stop_stats_agent():
+    return 'pkill -f "[s]tatsagent.py"; true'
+
+class ComputeHttpRequest(HttpRequest):
+    """HttpRequest whose execute goes through hook, see _build_request."""
+    hook = None
+
+    def execute(self, *args, **kwargs):
+        run = lambda: HttpRequest.execute(self, *args, **kwargs)
+        if self.hook is None:
+            return run()
+        return self.hook(self.methodId or 'compute.request', run)
+
+def _is_conflict(exception):
+    # 409 alreadyExists from an insert
+    resp = getattr(exception, 'resp', None)
+    return resp is not None and int(getattr(resp, 'status', 0)) == 409
+
+def _is_rate_limited(exception):
+    # Rate limits come back as 403 rateLimitExceeded/userRateLimitExceeded
+    # or as 429
+    resp = getattr(exception, 'resp', None)
+    if resp is None:
+        return False
+    status = int(getattr(resp, 'status', 0))
+    content = getattr(exception, 'content', '') or ''
+    if not isinstance(content, str):
+        content = content.decode('utf-8', 'replace')
+    return status == 429 or \
+        (status == 403 and 'ratelimitexceeded' in content.lower())
+
+def _is_retryable(exception):
+    # Transport errors (socket, TLS and HTTP protocol ones) carry no
+    # response; anything else without one is a bug, not worth a retry
+    resp = getattr(exception, 'resp', None)
+    if resp is None:
+        return isinstance(exception, (socket.error, httplib2.HttpLib2Error,
+                                      httplib.HTTPException))
+    status = int(getattr(resp, 'status', 0))
+    return status >= 500 or _is_rate_limited(exception)
 
 class gcp(Cloud):
-    def __init__(self, cloud, log):
+    def __init__(self, cloud, log, compute=None):
+        # compute replaces the Compute API client, e.g. with a
+        # fakegcp.FakeCompute for benchmarks
         super(gcp, self).__init__(cloud, log)
-        credentials = GoogleCredentials.get_application_default()
-        self.compute = discovery.build('compute', 'v1', credentials=credentials)
-        fabric_env.warn_only = True
-        fabric_env.use_shell = False
-        fabric_env.skip_bad_hosts = True
-        fabric_env.linewise = True
-        fabric_env.connection_attempts = 3
-        fabric_env.command_timeout = 600
-        fabric_env.keepalive = 30
-        fabric_env.timeout = 30 # Access to any host should not take more than 30 seconds
-        fabric_env.abort_exception = FabricException
-        fabric_env.abort_on_prompts = True
-        fabric_env.port = 22
-        fabric_env.user = cloud['clouddata']['ssh_username']
+        self.local = threading.local()
+        if compute is None:
+            self.credentials = GoogleCredentials.get_application_default()
+            compute = discovery.build('compute', 'v1',
+                credentials=self.credentials,
+                requestBuilder=self._build_request)
+        self.compute = compute
+        # every Compute request waits its turn here, see _compute_execute
+        self.limiter = RateLimiter(cloud['clouddata'].get('api_rate',
+                API_RATE), log,
+            min_rate=cloud['clouddata'].get('api_rate_min', 1),
+            max_rate=cloud['clouddata'].get('api_rate_max'),
+            name='Compute API')
         ssh_key_file = os.path.expanduser('~') + '/gcp_key'
         if not os.path.isfile(ssh_key_file):
             with open(ssh_key_file, 'w') as f:
                 f.write(cloud['clouddata']['ssh_private_key'])
         os.chmod(ssh_key_file, 0400)
-        fabric_env.key_filename = ssh_key_file
-        fabric_output['everything'] = False
-        fabric_output['exceptions'] = False
-        fabric_output['status'] = False
-        fabric_output['aborts'] = False
-        fabric_env.parallel = True
+        self.ssh = SSHExecutor(cloud['clouddata']['ssh_username'],
+                    ssh_key_file, log,
+                    concurrency=cloud['clouddata'].get('ssh_concurrency', 256),
+                    timeout=cloud['clouddata'].get('ssh_timeout', 600),
+                    control_persist=cloud['clouddata'].get(
+                        'ssh_control_persist', 0),
+                    control_dir=cloud['clouddata'].get('ssh_control_dir'))
         self.target_num_instances = 0
-
-    def wait_for_operation(self, zone, project, operation):
-        self.log.info('Waiting for operation %s to finish...' % operation)
-        tries = 0
-        while True:
-            tries = tries + 1
-            if tries > 50:
-                self.log.warn('Abandoing operation %s', operation)
-                return
-
+        self.image_cache_ttl = cloud['clouddata'].get('image_cache_ttl', 0)
+        self.image_cache_file = os.path.expanduser('~') + '/.gcp_image_cache.json'
+        self.image_cache_lock = threading.Lock()
+        self.image_cache = self._load_image_cache()
+        inventory_file = cloud['clouddata'].get('inventory_file',
+                        os.path.expanduser('~') + '/.perf_inventory.json')
+        self.inventory = Inventory(inventory_file,
+                        cloud['clouddata'].get('inventory_ttl', 600), log)
+        self.inventory_reconcile = False
+        self.reconciled = set()
+        # one controller client for the run, see _avi
+        self.avi = None
+        self.avi_lock = threading.Lock()
+        # log the controller changes createcloud and createvs would make
+        self.avi_plan = False
+
+    def _build_request(self, http, *args, **kwargs):
+        # httplib2.Http is not thread safe, so each thread that talks to the
+        # Compute API builds its requests on its own authorized connection
+        if not hasattr(self.local, 'http'):
+            self.local.http = self.credentials.authorize(httplib2.Http())
+        request = ComputeHttpRequest(self.local.http, *args, **kwargs)
+        request.hook = self._compute_execute
+        return request
+
+    def _compute_execute(self, method_id, execute):
+        """
+        Runs one Compute request behind the rate limiter and records it in
+        the run's metrics. A request turned away for the rate limit slows
+        the limiter down and is sent again, up to RATE_LIMIT_RETRIES times.
+        """
+        for attempt in xrange(RATE_LIMIT_RETRIES + 1):
+            self.limiter.acquire()
             try:
-                result = self.compute.zoneOperations().get(
-                    project=project,
-                    zone=zone,
-                    operation=operation['name']).execute()
-            except Exception:
-                self.log.warn('Exception %s getting op %s' % 
-                              (traceback.format_exc(), operation))
-                time.sleep(4)
+                with metrics.timed(method_id):
+                    result = execute()
+            except Exception as e:
+                if not _is_rate_limited(e):
+                    raise
+                self.limiter.throttled()
+                if attempt == RATE_LIMIT_RETRIES:
+                    raise
                 continue
+            self.limiter.succeeded()
+            return result
 
-            if result['status'] == 'DONE':
-                self.log.info("operation %s DONE." % operation)
+    def _get_operation(self, zone, project, name):
+        # zoneOperations.wait long-polls on the server until the op is DONE
+        # or about two minutes have passed, whichever comes first
+        try:
+            result = self.compute.zoneOperations().wait(project=project,
+                zone=zone, operation=name).execute()
+        except Exception:
+            self.log.warn('Exception waiting for op %s %s' % (name,
+                          traceback.format_exc()))
+            return {}
+        return {name: result}
+
+    def _running_operations(self, zone, project):
+        """Names of the zone's operations that aren't DONE yet."""
+        names = set()
+        request = self.compute.zoneOperations().list(project=project,
+            zone=zone, filter='(status ne "DONE")', maxResults=LIST_PAGE_SIZE,
+            fields='nextPageToken,items(name,status)')
+        while request is not None:
+            ops = request.execute()
+            names.update(op['name'] for op in ops.get('items', []))
+            request = self.compute.zoneOperations().list_next(
+                previous_request=request, previous_response=ops)
+        return names
+
+    def _get_operations(self, zone, project, names):
+        # one paged list per tick tells which ops are still running; just
+        # the ones that dropped out of it are fetched, once each, for their
+        # final result
+        try:
+            running = self._running_operations(zone, project)
+        except Exception:
+            self.log.warn('Exception listing ops %s' % traceback.format_exc())
+            return {}
+        requests = {}
+        for name in names:
+            if name in running:
+                continue
+            requests[name] = lambda name=name: self.compute.zoneOperations(
+                ).get(project=project, zone=zone, operation=name)
+        results, errors = self._execute_batched(requests, retries=0)
+        for name, exception in errors.iteritems():
+            self.log.warn('Exception getting op %s %s' % (name, exception))
+        return results
+
+    def iter_operations(self, zone, project, operations, timeout=OP_TIMEOUT):
+        """
+        Waits for a set of zone operations and yields (name, result) for each
+        one as it finishes. result is the final operation resource, so errors
+        are in result['error']; it is None for ops abandoned after timeout.
+        A single pending op is long-polled with zoneOperations.wait. For
+        several, each tick lists the zone's unfinished ops and fetches the
+        ones that finished with a batch request. The tick backs off while
+        nothing finishes and resets as soon as something does.
+        """
+        pending = set(op['name'] for op in operations if op)
+        deadline = time.time() + timeout
+        delay = OP_POLL_MIN
+        while pending:
+            if len(pending) == 1:
+                results = self._get_operation(zone, project, list(pending)[0])
+            else:
+                results = self._get_operations(zone, project, list(pending))
+
+            done = 0
+            for name, result in results.iteritems():
+                if result.get('status') != 'DONE':
+                    continue
+                pending.discard(name)
+                done = done + 1
                 if 'error' in result:
-                    self.log.error('operation %s error %s' % (operation['name'],
-                        result['error']))
-                return
+                    self.log.error('operation %s error %s' % (name,
+                                   result['error']))
+                else:
+                    self.log.info('operation %s DONE.' % name)
+                yield name, result
+
+            if not pending:
+                break
+            if time.time() > deadline:
+                for name in pending:
+                    self.log.warn('Abandoning operation %s', name)
+                    yield name, None
+                break
+
+            self.log.info('%d operations pending, %d finished this tick' %
+                          (len(pending), done))
+            if len(pending) == 1 and len(results) == 1 and not done:
+                # the server already held the request for us
+                continue
+            delay = OP_POLL_MIN if done else min(delay * 2, OP_POLL_MAX)
+            time.sleep(delay)
+
+    def wait_for_operations(self, zone, project, operations,
+                            timeout=OP_TIMEOUT):
+        ops = [op for op in operations if op]
+        self.log.info('Waiting for %d operations to finish...' % len(ops))
+        with metrics.timed('compute.wait_for_operations'):
+            results = dict(self.iter_operations(zone, project, ops, timeout))
+        failed = [n for n, r in results.iteritems() if not r or 'error' in r]
+        self.log.info('%d operations finished, %d failed' % (len(results),
+                      len(failed)))
+        return results
+
+    def wait_for_operation(self, zone, project, operation):
+        self.log.info('Waiting for operation %s to finish...' % operation)
+        results = self.wait_for_operations(zone, project, [operation])
+        return results.get(operation['name'])
 
-            self.log.info('operation %s status %s' % (operation['name'], 
-                                                      result['status']))
-            time.sleep(4)
+    def _load_image_cache(self):
+        if not self.image_cache_ttl or not os.path.isfile(self.image_cache_file):
+            return {}
+        try:
+            with open(self.image_cache_file) as f:
+                cache = json.load(f)
+        except Exception:
+            self.log.warn('Unable to read image cache %s %s' %
+                          (self.image_cache_file, traceback.format_exc()))
+            return {}
+        now = time.time()
+        return {k: v for k, v in cache.iteritems()
+                if now - v['time'] < self.image_cache_ttl}
+
+    def _save_image_cache(self):
+        if not self.image_cache_ttl:
+            return
+        try:
+            with self.image_cache_lock, open(self.image_cache_file, 'w') as f:
+                json.dump(self.image_cache, f, indent=2)
+        except Exception:
+            self.log.warn('Unable to write image cache %s %s' %
+                          (self.image_cache_file, traceback.format_exc()))
 
-    def _create_instance_config(self, name, inst_info):
+    def _source_image(self, inst_info):
+        # Image lookups are cached per (image_project, family/name) for the
+        # run, and on disk across runs when clouddata image_cache_ttl is set
+        image_project = inst_info.get('image_project', 'centos-cloud')
+        image_name = inst_info.get('image_name', '')
+        image_family = inst_info.get('image_family', 'centos-7')
+        if image_name:
+            key = '%s/images/%s' % (image_project, image_name)
+        else:
+            key = '%s/family/%s' % (image_project, image_family)
+        if key in self.image_cache:
+            return self.image_cache[key]['selfLink']
+
+        if not image_name:
+            image_response = self.compute.images().getFromFamily(
+                project=image_project, family=image_family).execute()
+        else:
+            image_response = self.compute.images().get(
+                project=image_project, image=image_name).execute()
+        self.log.info('Resolved image %s to %s' % (key,
+                      image_response['selfLink']))
+        self.image_cache[key] = {'selfLink': image_response['selfLink'],
+                                 'time': time.time()}
+        self._save_image_cache()
+        return image_response['selfLink']
+
+    def _create_instance_config(self, name, inst_info, ssh_user=None,
+                                ssh_key=None):
         zone = inst_info.get('zone', 'us-central1-b')
         inst_type = inst_info.get('instance_type', 'n1-standard-1')
         subnet = inst_info['subnet']
@@ -114,16 +404,7 @@ class gcp(Cloud):
         preemptible = inst_info.get('preemptible', False)
         scope = inst_info.get('scope', 'https://www.googleapis.com/auth/compute.readonly')
         tags = inst_info.get('tags', [])
-        image_project = inst_info.get('image_project', 'centos-cloud')
-        image_name = inst_info.get('image_name', '')
-        if not image_name:
-            image_family = inst_info.get('image_family', 'centos-7')
-            image_response = self.compute.images().getFromFamily(
-                project=image_project, family=image_family).execute()
-        else:
-            image_response = self.compute.images().get(
-                project=image_project, image=image_name).execute()
-        source_disk_image = image_response['selfLink']
+        source_disk_image = self._source_image(inst_info)
         external_access = inst_info.get('external_access', True)
 
         # Configure the machine
@@ -176,30 +457,31 @@ class gcp(Cloud):
         if tags:
             config['tags'] = tags
 
-        return config
-
-    def create_instance(self, name, inst_info, ssh_user, ssh_key, wait=False):
-        zone = inst_info.get('zone', 'us-central1-b')
-        project = inst_info['project']
-
-        config = self._create_instance_config(name, inst_info)
+        # Added at insert time so no get/setMetadata is needed afterwards
+        if ssh_key:
+            config['metadata'] = self._ssh_keys_metadata(ssh_user, ssh_key)
 
-        try:
-            operation = self.compute.instances().insert(project=project,
-                zone=zone, body=config).execute()
-        except Exception:
-            self.log.error('Exception creating instance %s %s' % (name,
-                traceback.format_exc()))
-            return None
-
-        self.log.info('Instance %s created operation %s. Waiting for '
-            'completion' % (name, operation))
-
-        if wait:
-            self.wait_for_operation(zone, project, operation)
-        else:
-            time.sleep(5)
+        return config
 
+    def _ssh_keys_metadata(self, ssh_user, ssh_key):
+        # ssh_key is of the form ssh-rsa key user@machine
+        ssh_key_list = ssh_key.split()
+        return {'items': [{'key': 'ssh-keys', 'value': '%s:ssh-rsa %s %s' % \
+                    (ssh_user, ssh_key_list[1], ssh_user)}]}
+
+    def _create_instance_template(self, inst_info, ssh_user, ssh_key):
+        # instanceProperties take the bare machine type name, not its URL
+        template = self._create_instance_config(None, inst_info, ssh_user,
+                                                ssh_key)
+        template.pop('name')
+        template['machineType'] = inst_info.get('instance_type', 'n1-standard-1')
+        return template
+
+    def _add_ssh_key(self, project, zone, name, ssh_user, ssh_key):
+        """
+        Merges the ssh key into the metadata of an instance that already
+        exists. New instances get the key at insert time instead.
+        """
         # ssh_key is of the form ssh-rsa key user@machine
         ssh_key_list = ssh_key.split()
 
@@ -222,26 +504,48 @@ class gcp(Cloud):
                     k_list = k.split()
                     if k_list[1] == ssh_key_list[1] and k_list[2] == ssh_user:
                         self.log.info('key for user %s found already' % ssh_user)
-                        added = True
-                        break
-                if not added:
-                    item['value'] = item['value'] + '\n%s:ssh-rsa %s %s' % \
-                        (ssh_user, ssh_key_list[1], ssh_user)
-                    added = True
+                        return None
+                item['value'] = item['value'] + '\n%s:ssh-rsa %s %s' % \
+                    (ssh_user, ssh_key_list[1], ssh_user)
+                added = True
 
         if not added:
             items.append({'key': 'ssh-keys', 'value': '%s:ssh-rsa %s %s' % \
                         (ssh_user, ssh_key_list[1], ssh_user)})
-                    
+
         body = {'kind': 'compute#metadata', 'fingerprint': fingerprint,
             'items': items}
 
         try:
-            operation = self.compute.instances().setMetadata(project=project, 
+            return self.compute.instances().setMetadata(project=project,
                 zone=zone, instance=name, body=body).execute()
         except Exception:
             self.log.error('Exception setMetadata instance %s %s' % (name,
                 traceback.format_exc()))
+        return None
+
+    def create_instance(self, name, inst_info, ssh_user, ssh_key, wait=False):
+        zone = inst_info.get('zone', 'us-central1-b')
+        project = inst_info['project']
+
+        config = self._create_instance_config(name, inst_info, ssh_user,
+                                              ssh_key)
+
+        try:
+            operation = self.compute.instances().insert(project=project,
+                zone=zone, body=config).execute()
+        except Exception as e:
+            if not _is_conflict(e):
+                self.log.error('Exception creating instance %s %s' % (name,
+                    traceback.format_exc()))
+                return None
+            self.log.info('Instance %s exists, checking its ssh key' % name)
+            operation = self._add_ssh_key(project, zone, name, ssh_user,
+                                          ssh_key)
+            if not operation:
+                return None
+
+        self.log.info('Instance %s operation %s' % (name, operation))
 
         if wait:
             self.wait_for_operation(zone, project, operation)
@@ -250,8 +554,11 @@ class gcp(Cloud):
 
     def _create_instances_sync(self, inst_info, prefix, num_instances, 
                                ssh_username, ssh_key):
-        instances = self.list_instances(inst_info)
-        prefix_instances = [i for i in instances if i['name'].startswith(prefix)]
+        if inst_info.get('bulk_create', False):
+            return self._create_instances_bulk(inst_info, prefix, num_instances,
+                                               ssh_username, ssh_key)
+        prefix_instances = self.list_instances(inst_info, prefix)
+        self.inventory.reconcile(prefix, prefix_instances)
 
         if len(prefix_instances) >= num_instances:
             self.log.info('Curr running instances %d fulfil target instances '
@@ -274,12 +581,62 @@ class gcp(Cloud):
 
         zone = inst_info.get('zone', 'us-central1-b')
         project = inst_info['project']
-        for op in ops:
-            if op:
-                self.wait_for_operation(zone, project, op)
+        self.wait_for_operations(zone, project, ops)
+
+        prefix_instances = self.list_instances(inst_info, prefix)
+        self.inventory.reconcile(prefix, prefix_instances)
+
+        self.log.info('%s instances prefix %s created', len(prefix_instances),
+                      prefix)
+
+        return prefix_instances
+
+    def _create_instances_bulk(self, inst_info, prefix, num_instances,
+                               ssh_username, ssh_key):
+        zone = inst_info.get('zone', 'us-central1-b')
+        project = inst_info['project']
+        prefix_instances = self.list_instances(inst_info, prefix)
+        self.inventory.reconcile(prefix, prefix_instances)
+
+        if len(prefix_instances) >= num_instances:
+            self.log.info('Curr running instances %d fulfil target instances '
+                          '%d' % (len(prefix_instances), num_instances))
+            return prefix_instances
+
+        # numbered past instances in every state, as a stopped or preempted
+        # one keeps its name and reusing it would fail the whole bulkInsert
+        inst_nums = [int(i['name'].split(prefix)[1]) for i in
+                     self.list_instances(inst_info, prefix, status=None)]
+        last_inst_num = max(inst_nums) if inst_nums else 0
+        to_create = num_instances - len(prefix_instances)
+        names = ['%s%s' % (prefix, last_inst_num + n + 1)
+                 for n in xrange(0, to_create)]
+
+        # One template for the whole fleet, and one bulkInsert per
+        # MAX_BULK_INSTANCES names. perInstanceProperties keys give the
+        # exact names so the <prefix><n> scheme is kept.
+        template = self._create_instance_template(inst_info, ssh_username,
+                                                  ssh_key)
+        ops = []
+        for start in xrange(0, len(names), MAX_BULK_INSTANCES):
+            chunk = names[start:start + MAX_BULK_INSTANCES]
+            body = {'count': len(chunk), 'instanceProperties': template,
+                    'perInstanceProperties': {n: {} for n in chunk}}
+            self.log.info('Creating %d instances %s..%s' % (len(chunk),
+                          chunk[0], chunk[-1]))
+            try:
+                op = self.compute.instances().bulkInsert(project=project,
+                    zone=zone, body=body).execute()
+            except Exception:
+                self.log.error('Exception creating instances %s..%s %s' %
+                    (chunk[0], chunk[-1], traceback.format_exc()))
+                continue
+            ops.append(op)
+
+        self.wait_for_operations(zone, project, ops)
 
-        instances = self.list_instances(inst_info)
-        prefix_instances = [i for i in instances if i['name'].startswith(prefix)]
+        prefix_instances = self.list_instances(inst_info, prefix)
+        self.inventory.reconcile(prefix, prefix_instances)
 
         self.log.info('%s instances prefix %s created', len(prefix_instances),
                       prefix)
@@ -298,6 +655,105 @@ class gcp(Cloud):
 
         return batch
 
+    def _execute_batch(self, requests, keys):
+        results = {}
+
+        def _batch_cb(request_id, response, exception):
+            results[request_id] = (response, exception)
+
+        batch = self._gcp_alloc_batch(self.compute, _batch_cb)
+        if not batch:
+            return {k: (None, Exception('batch alloc failed')) for k in keys}
+        methods = {}
+        for k in keys:
+            request = requests[k]()
+            methods[k] = getattr(request, 'methodId', None) or \
+                'compute.request'
+            batch.add(request, request_id=k)
+        # each request in a batch counts against the quota
+        self.limiter.acquire(len(keys))
+        try:
+            with metrics.timed('compute.batch'):
+                batch.execute()
+        except Exception as e:
+            self.log.warn('gcp: batch execute failed %s' %
+                          traceback.format_exc())
+            for k in keys:
+                results.setdefault(k, (None, e))
+        throttled = len([k for k, (_, e) in results.items()
+                         if e is not None and _is_rate_limited(e)])
+        if throttled:
+            self.limiter.throttled(throttled)
+        self.limiter.succeeded(len(keys) - throttled)
+        # the batch's time is already counted, the requests in it just
+        # add their counts and errors
+        for k, (response, exception) in results.items():
+            metrics.record(methods[k], None, exception)
+        return results
+
+    def _execute_batched(self, requests, batch_size=MAX_BATCH_REQUESTS,
+                         concurrency=BATCH_CONCURRENCY, retries=BATCH_RETRIES,
+                         cb=None, retried_ok=None):
+        """
+        Runs {key: request factory} as batch requests of at most batch_size
+        sub-requests, and no more than the rate limiter lets through in a
+        second, with up to concurrency batches in flight. Only the
+        sub-requests that failed with a retryable error are sent again, after
+        a jittered exponential backoff. retried_ok(exception), when given,
+        tells a retried request's error means an earlier attempt went
+        through, e.g. alreadyExists for an insert; the key then counts as
+        done with a None response. cb(key, response, exception) is called
+        once per key with its final outcome.
+        Returns (responses, errors), both keyed like requests.
+        """
+        responses = {}
+        errors = {}
+        pending = sorted(requests)
+        action = metrics.current_action()
+
+        def _run_batch(keys):
+            with metrics.action(action):
+                return self._execute_batch(requests, keys)
+
+        pool = ThreadPool(max(1, concurrency))
+        try:
+            for attempt in xrange(0, retries + 1):
+                if attempt:
+                    delay = random.uniform(0, BATCH_BACKOFF * 2 ** attempt)
+                    self.log.info('Retrying %d requests in %.1fs attempt %d' %
+                                  (len(pending), delay, attempt))
+                    time.sleep(delay)
+                # a batch bigger than a second of quota is throttled however
+                # it is paced, so batches are kept under the current rate
+                size = min(batch_size, self.limiter.burst())
+                chunks = [pending[i:i + size]
+                          for i in xrange(0, len(pending), size)]
+                results = {}
+                for r in pool.map(_run_batch, chunks):
+                    results.update(r)
+                pending = []
+                for k in sorted(results):
+                    response, exception = results[k]
+                    if exception and attempt and retried_ok and \
+                            retried_ok(exception):
+                        exception = None
+                    if exception and _is_retryable(exception) and \
+                            attempt < retries:
+                        pending.append(k)
+                        continue
+                    if exception:
+                        errors[k] = exception
+                    else:
+                        responses[k] = response
+                    if cb:
+                        cb(k, response, exception)
+                if not pending:
+                    break
+        finally:
+            pool.close()
+            pool.join()
+        return responses, errors
+
     def _create_instance_cb(self, request_str, response, exception):
         if self.target_num_instances > 0:
             self.target_num_instances = self.target_num_instances - 1
@@ -306,12 +762,6 @@ class gcp(Cloud):
         else:
             self.log.info('%s instances left', self.target_num_instances)
 
-        if exception:
-            self.log.error('Route add CB error %s %s', request_str, exception)
-            return
-
-        self.log.warn('Response %s', response)
-
         # request_str is a json encoded str
         try:
             mdata = json.loads(request_str)
@@ -319,59 +769,60 @@ class gcp(Cloud):
             self.log.warn('Unable to decode mdata %s', request_str)
             return
 
-        self.log.info('Instance %s created', mdata['name'])
-        # ssh_key is of the form ssh-rsa key user@machine
-        ssh_key_list = mdata['create_ssh_key'].split()
+        if exception and _is_conflict(exception):
+            self.log.info('Instance %s exists, checking its ssh key' %
+                          mdata['name'])
+            self._add_ssh_key(mdata['project'], mdata['zone'], mdata['name'],
+                              mdata['ssh_user'], mdata['create_ssh_key'])
+            return
 
-        try:
-            inst = self.compute.instances().get(project=mdata['project'], 
-                zone=mdata['zone'], instance=mdata['name']).execute()
-        except Exception:
-            self.log.error('Exception getting instance %s %s' % (mdata['name'],
-                traceback.format_exc()))
-            return None
+        if exception:
+            self.log.error('Create instance CB error %s %s', request_str,
+                           exception)
+            return
 
-        fingerprint = inst['metadata']['fingerprint']
-        items = inst['metadata'].get('items', [])
-        added = False
-        for item in items:
-            if item['key'] == 'ssh-keys':
-                # value is of the form 'user:ssh-rsa key user\nuser:ssh-rsa key user'
-                keys = item['value'].splitlines()
-                for k in keys:
-                    k_list = k.split()
-                    if (k_list[1] == ssh_key_list[1] and 
-                        k_list[2] == mdata['ssh_user']):
-                        self.log.info('key for user %s found already' % 
-                            mdata['ssh_user'])
-                        added = True
-                        break
-                if not added:
-                    item['value'] = item['value'] + '\n%s:ssh-rsa %s %s' % \
-                        (mdata['ssh_user'], ssh_key_list[1], mdata['ssh_user'])
-                    added = True
+        if response is None:
+            self.log.info('Instance %s created by an earlier attempt' %
+                          mdata['name'])
+            return
 
-        if not added:
-            items.append({'key': 'ssh-keys', 'value': '%s:ssh-rsa %s %s' % \
-                        (mdata['ssh_user'], ssh_key_list[1], mdata['ssh_user'])})
-                    
-        body = {'kind': 'compute#metadata', 'fingerprint': fingerprint,
-            'items': items}
+        self.log.info('Instance %s created operation %s', mdata['name'],
+                      response.get('name'))
 
-        try:
-            self.compute.instances().setMetadata(project=
-                mdata['project'], zone=mdata['zone'], instance=mdata['name'], 
-                body=body).execute()
-        except Exception:
-            self.log.error('Exception setMetadata instance %s %s' % 
-                           (mdata['name'], traceback.format_exc()))
+    def _insert_instances(self, inst_info, configs, ssh_username, ssh_key):
+        """
+        Inserts {name: config} with batched requests, split and run in
+        parallel per inst_info batch_size and batch_concurrency. Inserts that
+        hit rate limits or server errors are retried on their own.
+        Returns {'created': [names], 'failed': {name: error}}.
+        """
+        zone = inst_info.get('zone', 'us-central1-b')
+        project = inst_info['project']
+        requests = {}
+        for name, config in configs.iteritems():
+            requests[name] = lambda config=config: self.compute.instances(
+                ).insert(project=project, zone=zone, body=config)
+
+        def _insert_cb(name, response, exception):
+            mdata = {'create_ssh_key': ssh_key, 'name': name, 'zone': zone,
+                'project': project, 'ssh_user': ssh_username}
+            self._create_instance_cb(json.dumps(mdata), response, exception)
+
+        responses, errors = self._execute_batched(requests,
+            batch_size=inst_info.get('batch_size', MAX_BATCH_REQUESTS),
+            concurrency=inst_info.get('batch_concurrency', BATCH_CONCURRENCY),
+            retries=inst_info.get('batch_retries', BATCH_RETRIES),
+            cb=_insert_cb, retried_ok=_is_conflict)
+        return {'created': sorted(responses),
+                'failed': {k: str(e) for k, e in errors.iteritems()}}
 
     def _create_instances_async(self, inst_info, prefix, num_instances, 
                                 ssh_username, ssh_key):
-        zone = inst_info.get('zone', 'us-central1-b')
-        project = inst_info['project']
-        instances = self.list_instances(inst_info)
-        prefix_instances = [i for i in instances if i['name'].startswith(prefix)]
+        if inst_info.get('bulk_create', False):
+            return self._create_instances_bulk(inst_info, prefix, num_instances,
+                                               ssh_username, ssh_key)
+        prefix_instances = self.list_instances(inst_info, prefix)
+        self.inventory.reconcile(prefix, prefix_instances)
 
         if len(prefix_instances) >= num_instances:
             self.log.info('Curr running instances %d fulfil target instances '
@@ -385,37 +836,29 @@ class gcp(Cloud):
         last_inst_num = int(prefix_instances[0]['name'].split(prefix)[1]) if \
                     prefix_instances else 0
 
-        batch = self._gcp_alloc_batch(self.compute, self._create_instance_cb)
-        if not batch:
-            self.log.warn('unable to allocate batch')
-            return prefix_instances
-
+        configs = {}
         while to_create > 0:
             last_inst_num = last_inst_num + 1
             name = '%s%s' % (prefix, last_inst_num)
             self.log.info('Creating instance %s' % name)
-            config = self._create_instance_config(name, inst_info)
-            mdata = {'create_ssh_key': ssh_key, 'name': name, 'zone': zone,
-                'project': project, 'ssh_user': ssh_username}
-            try:
-                batch.add(self.compute.instances().insert(project=project,
-                    zone=zone, body=config), request_id=json.dumps(mdata))
-            except Exception:
-                self.log.warn('Unable to add create instance for %s exc %s',
-                              name, traceback.format_exc())
+            configs[name] = self._create_instance_config(name, inst_info,
+                                                         ssh_username, ssh_key)
             to_create = to_create - 1
 
-        for retry in range(5):
-            try:
-                batch.execute()
-                break
-            except:
-                self.log.error('gcp: batch execute failed retry %d %s', retry, 
-                    traceback.format_exc())
-                time.sleep(3)
-        
-        instances = self.list_instances(inst_info)
-        prefix_instances = [i for i in instances if i['name'].startswith(prefix)]
+        result = self._insert_instances(inst_info, configs, ssh_username,
+                                        ssh_key)
+        self.log.info('%d instances created, %d failed %s' %
+                      (len(result['created']), len(result['failed']),
+                       result['failed']))
+
+        # the new instances aren't RUNNING yet, so they go in as
+        # PROVISIONING and the role is left stale for fleet_instances
+        prefix_instances = self.list_instances(inst_info, prefix)
+        running = set(i['name'] for i in prefix_instances)
+        self.inventory.reconcile(prefix, prefix_instances + [
+            {'name': name, 'ip': None, 'status': 'PROVISIONING'}
+            for name in result['created'] if name not in running],
+            fresh=False)
 
         self.log.info('%s instances prefix %s created', len(prefix_instances),
                       prefix)
@@ -427,48 +870,394 @@ class gcp(Cloud):
         if inst_info.get('yum_install', False):
             insts = self._create_instances_sync(inst_info, prefix, num_instances, 
                                       ssh_username, ssh_key)
-            ips = [i['info']['networkInterfaces'][0]['networkIP'] for i in insts]
+            ips = [i['ip'] for i in insts]
             image = inst_info.get('image_name',
                         inst_info.get('image_family', 'centos-7'))
-            self.log.info('Starting install_ab_task on %s IPs %s', len(ips), ips)
-            num_ips = len(ips)
-            start = 0
-            while True:
-                end = start + 10 if start+10 < num_ips else num_ips-1
-                self.log.info('Processing 10 ips %s', ips[start:end])
-                self._run_task(ips[start:end], install_ab_task, image)
-                start = start + 10
-                if end == num_ips-1:
-                    break
+            driver = get_driver(inst_info)
+            self._install(inst_info, ips, install_load_task,
+                          driver.install_cmd, image, driver.check_cmd)
         else:
             insts = self._create_instances_async(inst_info, prefix, num_instances, 
                                       ssh_username, ssh_key)
         return insts
 
+    def _install(self, inst_info, ips, task, *args):
+        """
+        Runs an install task on all ips at once, install_concurrency at a
+        time, and retries it on the hosts it failed on. Returns the hosts
+        still failing after the last retry.
+        """
+        concurrency = inst_info.get('install_concurrency')
+        retries = inst_info.get('install_retries', INSTALL_RETRIES)
+        pending = sorted(ips)
+        installed = skipped = 0
+        for attempt in xrange(retries + 1):
+            if attempt:
+                delay = BATCH_BACKOFF ** attempt + random.random()
+                self.log.info('Retrying %s on %d hosts in %.1fs' %
+                              (task.__name__, len(pending), delay))
+                time.sleep(delay)
+            results = self._run_task(pending, task, *args,
+                                     concurrency=concurrency)
+            failed = []
+            for host in pending:
+                r = results.get(host)
+                if r is None or r['exit'] != 0:
+                    failed.append(host)
+                elif INSTALLED in r['stdout']:
+                    skipped += 1
+                else:
+                    installed += 1
+            pending = failed
+            if not pending:
+                break
+        self.log.info('%s on %d hosts: %d installed, %d already installed, '
+                      '%d failed' % (task.__name__, len(ips), installed,
+                      skipped, len(pending)))
+        if pending:
+            self.log.warn('%s failed on %s' % (task.__name__, pending))
+        return pending
+
+    def _collect_results(self, inst_info, ips, driver, save=True):
+        """
+        Gathers the load generator output left on each client, merges it
+        into one run result, logs it and saves it as JSON unless save is
+        False. Returns None if no client had anything to report.
+        """
+        outputs = dict((host, r['stdout']) for host, r in
+                       self._run_task(ips, collect_load_results).items()
+                       if r['exit'] == 0)
+        run = merge_results(outputs, driver.parse)
+        if not run['clients']:
+            self.log.info('No %s results found on %d clients' % (driver.name,
+                          len(ips)))
+            return None
+        run['driver'] = driver.name
+        for line in format_results(run):
+            self.log.info(line)
+        if not save:
+            return run
+        results_file = inst_info.get('results_file', '%s-results-%s.json' %
+                            (driver.name, time.strftime('%Y%m%d-%H%M%S')))
+        try:
+            with open(results_file, 'w') as f:
+                json.dump(run, f, indent=2, sort_keys=True)
+            self.log.info('Results saved in %s' % results_file)
+        except Exception:
+            self.log.warn('Unable to save results %s %s' % (results_file,
+                          traceback.format_exc()))
+        return run
+
     def start_test(self, inst_info, vip, prefix, num_instances):
-        instances = self.list_instances(inst_info)
-        ii = [i for i in instances if i['name'].startswith(prefix)]
+        driver = get_driver(inst_info)
+        ii = self.fleet_instances(inst_info, prefix)
         if len(ii) < num_instances:
             self.log.warn('Just %d instances running %d requested' % 
                           (len(ii), num_instances))
-        ips = {i['info']['networkInterfaces'][0]['networkIP'] for i in ii}
-        self._run_task(ips, start_ab, vip, inst_info['client_threads'])
+        ips = {i['ip'] for i in ii}
+        if not ips:
+            return None
+        # A restart reports on the run it replaces
+        self._run_task(ips, stop_load, driver.stop_cmd())
+        self._collect_results(inst_info, ips, driver)
+        if driver.files:
+            self._run_task(ips, upload_files, driver.files)
+        if inst_info.get('load_profile'):
+            steps = expand_profile(inst_info['load_profile'], len(ips))
+            return self._run_profile(inst_info, vip, ips, driver, steps)
+        collector = self._stats_collector(inst_info, ips) \
+            if driver.reports_stats else None
+        self._run_task(ips, start_load, driver.commands(vip,
+                       inst_info['client_threads'], collector))
+
+    def _driver_rates(self, point, run, driver):
+        """
+        Makes the load generators' own results for a step the point's tps,
+        requests, error rate and p99. statsagent counts TCP connections, not
+        requests, so the stats stream only stands in when the driver reports
+        its own per request stats; otherwise a step without results counts
+        no requests.
+        """
+        if run:
+            total = run['total']
+            point['tps'] = total['rps']
+            point['requests'] = total['requests']
+            attempts = total['requests'] + total['failed']
+            point['error_rate'] = float(total['failed']) / attempts \
+                if attempts else 0.0
+            if 99 in total['latency']:
+                point['p99'] = total['latency'][99]
+        elif driver.reports_stats:
+            point['requests'] = int(point['tps'] * point['hold'])
+        else:
+            self.log.warn('No %s results for the step, its request rate is '
+                          'unknown' % driver.name)
+            point['tps'] = 0.0
+            point['requests'] = 0
+        return point
+
+    def _run_profile(self, inst_info, vip, ips, driver, steps):
+        """
+        Carries out load profile steps against the fleet. Load keeps running
+        across steps; each step starts or stops just the clients it adds or
+        drops, lets the load settle and is measured over the rest of its
+        hold. Drivers that report their own stats are measured from the
+        stream. For the rest the stream counts connections, so their steps
+        are filled in from the results each client prints when it stops,
+        see profiles.client_rates; clients a step drops are collected then.
+        Returns the throughput curve, which is also saved as JSON.
+        """
+        ips = sorted(ips)
+        threads = inst_info['client_threads']
+        settle = inst_info.get('profile_settle', 5)
+        collector = self._stats_collector(inst_info, ips)
+        cmds = driver.commands(vip, threads,
+                               collector if driver.reports_stats else None)
+        aggregator = StatsAggregator(inst_info.get('stats_port', 8125),
+                                     self.log)
+        if not driver.reports_stats:
+            self._run_task(ips, start_stats_agent, collector, 0,
+                           driver.process)
+        self.log.info('Load profile of %d steps, %d seconds' % (len(steps),
+                      sum(s['hold'] for s in steps)))
+        active = []
+        # ip -> step its load started at, and (first step, last step,
+        # result) for every client run that ended
+        started = {}
+        runs = []
+        step = -1
+
+        def _stop(hosts, last):
+            # start_load clears a client's output, so it is collected as
+            # soon as the client stops
+            self._run_task(hosts, stop_load, driver.stop_cmd())
+            run = self._collect_results(inst_info, hosts, driver, save=False)
+            for ip in hosts:
+                runs.append((started.pop(ip), last,
+                             run['clients'].get(ip) if run else None))
+
+        curve = []
+        try:
+            for step, s in enumerate(steps):
+                target = ips[:s['clients']]
+                if len(target) > len(active):
+                    self._run_task(target[len(active):], start_load, cmds)
+                    started.update((ip, step)
+                                   for ip in target[len(active):])
+                elif len(target) < len(active):
+                    _stop(active[len(target):], step - 1)
+                active = target
+                self.log.info('Step %d: %d clients for %d seconds' % (
+                              step, len(active), s['hold']))
+                if s['hold'] <= 0:
+                    continue
+                wait = min(settle, s['hold'] / 2.0)
+                aggregator.run(wait)
+                before = aggregator.totals()
+                aggregator.run(s['hold'] - wait)
+                point = window_rates(before, aggregator.totals())
+                point.update({'step': step, 'clients': len(active),
+                              'threads': len(active) * threads,
+                              'hold': s['hold']})
+                point['requests'] = int(point['tps'] * s['hold'])
+                curve.append(point)
+        except KeyboardInterrupt:
+            self.log.info('Load profile interrupted at step %d' % step)
+        finally:
+            aggregator.close()
+            if not driver.reports_stats:
+                self._run_task(ips, stop_stats_agent)
+            if active:
+                _stop(active, step)
+        if not driver.reports_stats:
+            client_rates(curve, runs)
+        for line in format_curve(curve):
+            self.log.info(line)
+        profile_file = inst_info.get('profile_file', '%s-profile-%s.json' %
+                            (driver.name, time.strftime('%Y%m%d-%H%M%S')))
+        try:
+            with open(profile_file, 'w') as f:
+                json.dump({'driver': driver.name, 'steps': curve}, f,
+                          indent=2, sort_keys=True)
+            self.log.info('Load profile curve saved in %s' % profile_file)
+        except Exception:
+            self.log.warn('Unable to save load profile %s %s' %
+                          (profile_file, traceback.format_exc()))
+        return curve
 
     def stop_test(self, inst_info, prefix):
-        instances = self.list_instances(inst_info)
-        ii = [i for i in instances if i['name'].startswith(prefix)]
-        ips = {i['info']['networkInterfaces'][0]['networkIP'] for i in ii}
-        self._run_task(ips, stop_ab)
+        driver = get_driver(inst_info)
+        ii = self.fleet_instances(inst_info, prefix)
+        ips = {i['ip'] for i in ii}
+        self._run_task(ips, stop_load, driver.stop_cmd())
+        return self._collect_results(inst_info, ips, driver)
+
+    def find_peak(self, inst_info, vip, prefix):
+        """
+        Searches for the highest tps the clients createclient provisioned
+        can drive within the slo in the client section, changing the number
+        of active clients and the processes per client between probes. Each
+        probe runs load, lets it settle, measures it and collects results.
+        Returns the report, which is also saved as JSON.
+        """
+        driver = get_driver(inst_info)
+        ips = sorted(i['ip'] for i in self.fleet_instances(inst_info, prefix))
+        if not ips:
+            self.log.warn('No client instances prefix %s' % prefix)
+            return None
+        slo = inst_info.get('slo', {'max_error_rate': 0.01})
+        opts = inst_info.get('findpeak', {})
+        settle = opts.get('settle', 10)
+        duration = opts.get('probe', 60)
+        collector = self._stats_collector(inst_info, ips)
+        self._run_task(ips, stop_load, driver.stop_cmd())
+        if driver.files:
+            self._run_task(ips, upload_files, driver.files)
+        aggregator = StatsAggregator(inst_info.get('stats_port', 8125),
+                                     self.log)
+        if not driver.reports_stats:
+            self._run_task(ips, start_stats_agent, collector, 0,
+                           driver.process)
+
+        def probe(clients, threads):
+            active = ips[:clients]
+            self.log.info('findpeak probe: %d clients x %d' % (clients,
+                          threads))
+            self._run_task(active, start_load, driver.commands(vip, threads,
+                           collector if driver.reports_stats else None))
+            aggregator.run(settle)
+            before = aggregator.totals()
+            aggregator.run(duration)
+            point = window_rates(before, aggregator.totals())
+            self._run_task(active, stop_load, driver.stop_cmd())
+            run = self._collect_results(inst_info, active, driver,
+                                        save=False)
+            point.update({'clients': clients, 'threads': threads,
+                          'offered': clients * threads, 'hold': duration})
+            self._driver_rates(point, run, driver)
+            point['violation'] = slo_violation(point, slo)
+            point['pass'] = point['violation'] is None
+            self.log.info('findpeak probe: %d clients x %d %.1f tps %s' % (
+                          clients, threads, point['tps'],
+                          'ok' if point['pass'] else point['violation']))
+            return point
+
+        try:
+            peak, probes = find_peak(probe, len(ips),
+                                     inst_info['client_threads'],
+                                     opts.get('start_clients', 1))
+        finally:
+            aggregator.close()
+            if not driver.reports_stats:
+                self._run_task(ips, stop_stats_agent)
+        if peak:
+            self.log.info('Peak %.1f tps within slo at %d clients x %d, '
+                          'error rate %.2f%% p99 %s ms' % (peak['tps'],
+                          peak['clients'], peak['threads'],
+                          100.0 * peak['error_rate'], peak['p99']))
+        else:
+            self.log.warn('No probe met the slo %s' % slo)
+        report = {'driver': driver.name, 'slo': slo, 'peak': peak,
+                  'probes': probes}
+        report_file = inst_info.get('findpeak_file', '%s-findpeak-%s.json' %
+                            (driver.name, time.strftime('%Y%m%d-%H%M%S')))
+        try:
+            with open(report_file, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.log.info('findpeak report saved in %s' % report_file)
+        except Exception:
+            self.log.warn('Unable to save findpeak report %s %s' %
+                          (report_file, traceback.format_exc()))
+        return report
+
+    def _stats_collector(self, inst_info, ips):
+        """ip:port clients send watchtest stats to."""
+        port = inst_info.get('stats_port', 8125)
+        collector = inst_info.get('stats_collector')
+        if not collector:
+            # the address this host uses to reach the clients
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.connect((next(iter(ips)), port))
+            collector = s.getsockname()[0]
+            s.close()
+        return '%s:%d' % (collector, port)
+
+    def watch_test(self, inst_info, prefix, duration=0):
+        """
+        Starts a stats agent on every client, streaming counters back to
+        this host, and logs a once per second fleet view until duration
+        seconds have passed or it is interrupted. Drivers that report their
+        own stats need no agent. Returns the last view.
+        """
+        ips = {i['ip'] for i in self.fleet_instances(inst_info, prefix)}
+        if not ips:
+            self.log.warn('No client instances prefix %s' % prefix)
+            return None
+        driver = get_driver(inst_info)
+        aggregator = StatsAggregator(inst_info.get('stats_port', 8125),
+                                     self.log)
+        if not driver.reports_stats:
+            self._run_task(ips, start_stats_agent,
+                           self._stats_collector(inst_info, ips), duration,
+                           driver.process)
+        try:
+            return aggregator.run(duration)
+        except KeyboardInterrupt:
+            self.log.info('watchtest interrupted')
+        finally:
+            aggregator.close()
+            if not driver.reports_stats:
+                self._run_task(ips, stop_stats_agent)
+
+    def close(self):
+        self.ssh.close()
 
     def _run_task(self, inst_ips, task, *args, **kwargs):
+        """
+        Runs the command task returns on every host at once over ssh, or
+        on concurrency hosts at a time when that is passed. Returns
+        {host: result} as SSHExecutor.run does, failures are logged.
+        """
         hosts = list(inst_ips)
-        with settings(parallel=True, pool_size=32):
-            try:
-                result = execute(task, hosts=hosts, *args, **kwargs)
-                self.log.info('se_ssh res %s', result)
-            except Exception as e:
-                self.log.warn('Failed to execute task for hosts %s: %s' %
-                              (hosts, e))
+        if not hosts:
+            return {}
+        concurrency = kwargs.pop('concurrency', None)
+        cmd = task(*args, **kwargs)
+        stdin = None
+        if isinstance(cmd, tuple):
+            cmd, stdin = cmd
+        start = time.time()
+        try:
+            results = self.ssh.run(hosts, cmd, stdin=stdin,
+                                   concurrency=concurrency)
+        except Exception:
+            self.log.warn('Failed to execute %s for %d hosts: %s' %
+                          (task.__name__, len(hosts), traceback.format_exc()))
+            return {}
+        for r in results.values():
+            metrics.record('ssh.%s' % task.__name__, r['duration'],
+                'timeout' if r['timeout'] else 'exit %s' % r['exit']
+                if r['exit'] != 0 else None)
+        failed = sorted((r for r in results.values() if r['exit'] != 0),
+                        key=lambda r: r['host'])
+        self.log.info('%s on %d hosts in %.1fs, %d failed' % (task.__name__,
+                      len(hosts), time.time() - start, len(failed)))
+        for r in failed[:10]:
+            self.log.warn('%s failed on %s: %s %s' % (task.__name__, r['host'],
+                'timed out after %.0fs' % r['duration'] if r['timeout']
+                else 'exit %s' % r['exit'], r['stderr'].strip()[-200:]))
+        if len(failed) > 10:
+            self.log.warn('%s failed on %d more hosts' % (task.__name__,
+                          len(failed) - 10))
+        return results
+
+    def _avi(self, ctrlr_inst_info):
+        """The run's controller client, shared by every phase."""
+        with self.avi_lock:
+            if self.avi is None:
+                self.avi = AviClient(ctrlr_inst_info, self.log,
+                                     self.avi_plan)
+            return self.avi
 
     def _create_ses(self, api, cloud, inst_ips):
         cloud_obj = api.get_object_by_name('cloud', cloud)
@@ -491,10 +1280,15 @@ class gcp(Cloud):
                 {u'attr_key': u'SE_INBAND_MGMT', u'attr_val': u'False'}]}
             cloud_obj['linuxserver_configuration']['hosts'].append(h)
         if inst_ips:
-            put_rsp = api.put('cloud/%s' % cloud_obj['uuid'], data=cloud_obj)
+            put_rsp, _ = api.update('cloud', cloud_obj)
             self.log.info('Updated Cloud obj status %d %s' % 
                           (put_rsp.status_code, put_rsp.text))
 
+    def create_se_instances(self, se_inst_info, prefix, num_instances,
+                            ssh_username, ssh_public_key):
+        return self._create_instances_sync(se_inst_info, prefix, num_instances,
+                                           ssh_username, ssh_public_key)
+
     def create_ses(self, se_inst_info, ctrlr_inst_info, prefix, num_instances, 
                    ssh_username, ssh_public_key, ssh_private_key):
         ii = self._create_instances_sync(se_inst_info, prefix, num_instances, 
@@ -505,48 +1299,88 @@ class gcp(Cloud):
             return 0
         self.log.info('Starting SE creation %s prefix %d instances' %
                       (prefix, num_instances))
-        tenant = ctrlr_inst_info.get('tenant', 'admin')
         cloud = ctrlr_inst_info.get('cloud', 'Default-Cloud')
-        avi_api = ApiSession.get_session(ctrlr_inst_info['api_endpoint'], 
-            ctrlr_inst_info['username'], ctrlr_inst_info['password'], 
-            tenant=tenant)
-        ips = {i['info']['networkInterfaces'][0]['networkIP'] for i in ii}
+        avi_api = self._avi(ctrlr_inst_info)
+        ips = {i['ip'] for i in ii}
         if se_inst_info.get('yum_install', False):
             image = se_inst_info.get('image_name', se_inst_info.get(
                                                 'image_family', 'centos-7'))
             self._run_task(ips, install_docker_task, image)
-        self._create_ses(avi_api, cloud, ips)
-        up_ses = set()
-        for i in xrange(0, 60):
-            ses = avi_api.get('serviceengine')
-            if ses.status_code != 200:
-                self.log.warn('Unable to retrive SEs from %s' % 
-                              ctrlr_inst_info['api_endpoint'])
-                break
-            se_objs = json.loads(ses.text)
-            target = False
-            for se in se_objs['results']:
-                if 'oper_status' not in se:
-                    time.sleep(5)
-                elif se['oper_status']['state'] != 'OPER_UP':
-                    self.log.info('SE %s oper status %s not up' %
-                                  (se['name'], se['oper_status']))
-                    time.sleep(5)
-                else:
-                    # name is of the form 10.70.119.35--se--dark-lake-qaa7v
-                    l = se['name'].split('--se--')
-                    up_ses.add(l[0])
-                if len(up_ses) >= num_instances:
-                    target = True
-                    break
-            if target:
-                break
-            self.log.info('SE targets not reached yet %d SEs retrieved' %
-                          len(se_objs['results']))
-            time.sleep(5)
+        # _create_ses drops the hosts the cloud already has from its set
+        self._create_ses(avi_api, cloud, set(ips))
+        up_ses = self._wait_for_ses(avi_api, ips, num_instances,
+            se_inst_info.get('se_ready_timeout', SE_READY_TIMEOUT))
         self.log.info('%d SEs created' % len(up_ses))
         return len(up_ses)
 
+    def _avi_list(self, avi_api, path, fields=None, page_size=AVI_PAGE_SIZE):
+        """
+        All objects of a type, following the controller's pages. fields
+        limits what the controller sends back. Returns None on error.
+        """
+        objs = []
+        params = {'page_size': page_size, 'page': 1}
+        if fields:
+            params['fields'] = fields
+        while True:
+            rsp = avi_api.get(path, params=dict(params))
+            if rsp.status_code != 200:
+                self.log.warn('Unable to retrieve %s status %d %s' % (path,
+                              rsp.status_code, rsp.text))
+                return None
+            page = json.loads(rsp.text)
+            objs.extend(page.get('results', []))
+            if not page.get('next') or not page.get('results') or \
+                    len(objs) >= page.get('count', 0):
+                return objs
+            params['page'] = params['page'] + 1
+
+    def _avi_count(self, avi_api, path):
+        """Number of objects of a type, None on error."""
+        rsp = avi_api.get(path, params={'page_size': 1, 'fields': 'uuid'})
+        if rsp.status_code != 200:
+            self.log.warn('Unable to retrieve %s status %d %s' % (path,
+                          rsp.status_code, rsp.text))
+            return None
+        return json.loads(rsp.text).get('count', 0)
+
+    def _wait_for_ses(self, avi_api, ips, target, timeout=SE_READY_TIMEOUT):
+        """
+        Polls the SEs until target of the hosts in ips are OPER_UP or
+        timeout seconds pass. One paged listing of just name and status per
+        cycle. Returns the set of host IPs with an SE up.
+        """
+        deadline = time.time() + timeout
+        up = set()
+        while True:
+            ses = self._avi_list(avi_api, 'serviceengine',
+                                 fields='name,oper_status')
+            if ses is None:
+                return up
+            states = {}
+            for se in ses:
+                # name is of the form 10.70.119.35--se--dark-lake-qaa7v
+                ip = se['name'].split('--se--')[0]
+                if ip not in ips:
+                    continue
+                state = se.get('oper_status', {}).get('state', 'NO_STATUS')
+                if state == 'OPER_UP':
+                    up.add(ip)
+                else:
+                    up.discard(ip)
+                    states[state] = states.get(state, 0) + 1
+            pending = len(ips) - len(up)
+            self.log.info('SEs up %d/%d, pending %d %s' % (len(up), target,
+                          pending, ' '.join('%s:%d' % s for s in
+                                            sorted(states.items()))))
+            if len(up) >= target:
+                return up
+            if time.time() + SE_POLL_INTERVAL > deadline:
+                self.log.warn('SEs not up after %d seconds: %s' % (timeout,
+                              ', '.join(sorted(ips - up))))
+                return up
+            time.sleep(SE_POLL_INTERVAL)
+
     def create_pool(self, pool_inst_info, prefix, num_instances, 
                    ssh_username, ssh_public_key):
         ii = self._create_instances_sync(pool_inst_info, prefix, num_instances, 
@@ -555,7 +1389,7 @@ class gcp(Cloud):
             self.log.warn('Just %d instances running %d requested' % 
                           (len(ii), num_instances))
             return 0
-        ips = {i['info']['networkInterfaces'][0]['networkIP'] for i in ii}
+        ips = {i['ip'] for i in ii}
         if pool_inst_info.get('yum_install', False):
             image = pool_inst_info.get('image_name', 
                         pool_inst_info.get('image_family', 'centos-7'))
@@ -564,28 +1398,24 @@ class gcp(Cloud):
 
     def _delete_cc_config_ses(self, ctrlr_inst_info, avi_api, cloud_obj):
         cloud_obj['linuxserver_configuration']['hosts'] = []
-        put_rsp = avi_api.put('cloud/%s' % cloud_obj['uuid'], data=cloud_obj)
+        put_rsp, _ = avi_api.update('cloud', cloud_obj)
         self.log.info('Updated Cloud obj status %d %s' % 
                           (put_rsp.status_code, put_rsp.text))
-        for i in xrange(0, 60):
-            ses = avi_api.get('serviceengine')
-            if ses.status_code != 200:
-                self.log.warn('Unable to retrive SEs from %s' % 
-                              ctrlr_inst_info['api_endpoint'])
+        deadline = time.time() + SE_READY_TIMEOUT
+        while True:
+            remaining = self._avi_count(avi_api, 'serviceengine')
+            if not remaining:
                 return
-            se_objs = json.loads(ses.text)
-            if len(se_objs['results']) > 0:
-                self.log.info('%d SEs remain' % (len(se_objs['results'])))
-                time.sleep(5)
-            else:
-                break
+            self.log.info('%d SEs remain' % remaining)
+            if time.time() + SE_POLL_INTERVAL > deadline:
+                self.log.warn('%d SEs remain after %d seconds' % (remaining,
+                              SE_READY_TIMEOUT))
+                return
+            time.sleep(SE_POLL_INTERVAL)
 
     def delete_ses(self, se_inst_info, ctrlr_inst_info, prefix):
-        tenant = ctrlr_inst_info.get('tenant', 'admin')
         cloud = ctrlr_inst_info.get('cloud', 'Default-Cloud')
-        avi_api = ApiSession.get_session(ctrlr_inst_info['api_endpoint'], 
-            ctrlr_inst_info['username'], ctrlr_inst_info['password'], 
-            tenant=tenant)
+        avi_api = self._avi(ctrlr_inst_info)
         cloud_obj = avi_api.get_object_by_name('cloud', cloud)
         if not cloud_obj:
             self.log.warn('Unable to retrieve cloud %s' % cloud)
@@ -593,24 +1423,58 @@ class gcp(Cloud):
         if ('linuxserver_configuration' in cloud_obj and 
                 cloud_obj['linuxserver_configuration'].get('hosts', [])):
             self._delete_cc_config_ses(ctrlr_inst_info, avi_api, cloud_obj)
-        self.delete_instances(se_inst_info, prefix)
-
-    def list_instances(self, inst_info):
+        self.delete_instances(se_inst_info, prefix, wait=True)
+
+    def iter_instances(self, inst_info, prefix=None, status='RUNNING'):
+        """
+        Yields {'name', 'ip', 'status', 'info'} for each instance in the zone,
+        following nextPageToken. The name prefix and status filters are
+        applied by the server, and only the fields callers use are fetched.
+        status=None lists instances in any state. A page that can't be
+        fetched raises rather than cutting the listing short.
+        """
         zone = inst_info.get('zone', 'us-central1-b')
         project = inst_info['project']
-        try:
-            insts = self.compute.instances().list(project=project, 
-                                                 zone=zone).execute()
-        except Exception:
-            self.log.error('Exception listing instances %s' % 
-                traceback.format_exc())
-            return []
-
-        inst_list = []
-        for i in insts['items']:
-            if i['status'] == 'RUNNING':
-                inst_list.append({'name': i['name'], 'info': i})
-        return inst_list
+        # filter values are RE2 expressions that must match the whole field
+        filters = []
+        if prefix:
+            filters.append('(name eq "%s.*")' % re.escape(prefix))
+        if status:
+            filters.append('(status eq "%s")' % status)
+        request = self.compute.instances().list(project=project, zone=zone,
+            filter=' '.join(filters) or None, maxResults=LIST_PAGE_SIZE,
+            fields='nextPageToken,items(name,status,networkInterfaces/networkIP)')
+        while request is not None:
+            try:
+                insts = request.execute()
+            except Exception:
+                # a partial list would pass for the whole fleet
+                self.log.error('Exception listing instances %s' %
+                    traceback.format_exc())
+                raise
+            for i in insts.get('items', []):
+                nics = i.get('networkInterfaces', [{}])
+                yield {'name': i['name'], 'ip': nics[0].get('networkIP'),
+                       'status': i['status'], 'info': i}
+            request = self.compute.instances().list_next(
+                previous_request=request, previous_response=insts)
+
+    def list_instances(self, inst_info, prefix=None, status='RUNNING'):
+        return list(self.iter_instances(inst_info, prefix, status))
+
+    def fleet_instances(self, inst_info, prefix):
+        """
+        Running instances for a role prefix from the local inventory. The
+        cloud is only listed when the role is stale or a reconcile was asked
+        for with --reconcile.
+        """
+        if ((self.inventory_reconcile and prefix not in self.reconciled) or
+                self.inventory.is_stale(prefix)):
+            instances = self.list_instances(inst_info, prefix)
+            self.inventory.reconcile(prefix, instances)
+            self.reconciled.add(prefix)
+            return instances
+        return self.inventory.instances(prefix)
 
     def delete_instance(self, inst_info, name, wait=False):
         zone = inst_info.get('zone', 'us-central1-b')
@@ -624,163 +1488,137 @@ class gcp(Cloud):
         return operation
 
     def delete_instances(self, inst_info, prefix, wait=False):
-        instances = self.list_instances(inst_info)
+        """
+        Deletes every instance with the prefix, in any state, using batched
+        deletes. With wait, it also waits for all of the delete operations,
+        checks that nothing with the prefix is left and returns what is.
+        """
+        t0 = time.time()
         zone = inst_info.get('zone', 'us-central1-b')
         project = inst_info['project']
+        instances = self.list_instances(inst_info, prefix, status=None)
 
-        ops = []
+        requests = {}
         for i in instances:
-            if i['name'].startswith(prefix):
-                self.log.info('Deleting instance %s' % i['name'])
-                op = self.delete_instance(inst_info, i['name'], wait)
-                ops.append(op)
+            self.log.info('Deleting instance %s' % i['name'])
+            requests[i['name']] = lambda name=i['name']: \
+                self.compute.instances().delete(project=project, zone=zone,
+                                                instance=name)
+        ops, errors = self._execute_batched(requests,
+            batch_size=inst_info.get('batch_size', MAX_BATCH_REQUESTS),
+            concurrency=inst_info.get('batch_concurrency', BATCH_CONCURRENCY),
+            retries=inst_info.get('batch_retries', BATCH_RETRIES))
+        for name, e in errors.iteritems():
+            self.log.error('Exception deleting instance %s %s' % (name, e))
+        # instances whose delete failed stay in the inventory
+        self.inventory.remove(prefix, sorted(ops))
+
+        if not wait:
+            return []
 
-        if wait:
-            for op in ops:
-                if op:
-                    self.wait_for_operation(zone, project, op)
-
-    def _create_cc_user(self, avi_api, ssh_user, ssh_pub_key, ssh_priv_key):
-        cc_user_obj = {'name': ssh_user, 'public_key': ssh_pub_key,
-            'private_key': ssh_priv_key}
-        resp = avi_api.post('cloudconnectoruser', data=cc_user_obj)
-        self.log.info('Created cc user %s rsp %s' % (cc_user_obj, resp.text))
-        if resp.status_code >= 300:
-            self.log.warn('Error creating cc user obj %s' % resp.status_code)
-            return None
-        return avi_api.get_object_by_name('cloudconnectoruser', ssh_user)
+        self.wait_for_operations(zone, project, ops.values())
+        remaining = self.list_instances(inst_info, prefix, status=None)
+        if remaining:
+            self.log.warn('%d instances prefix %s remain %s' % (len(remaining),
+                          prefix, [i['name'] for i in remaining]))
+            self.inventory.add(prefix, remaining)
+        self.log.info('Deleted %d instances prefix %s in %.1fs' %
+                      (len(instances) - len(remaining), prefix,
+                       time.time() - t0))
+        return remaining
 
     def create_cloud(self, ctrlr_inst_info, se_inst_info,
                  ssh_user, ssh_pub_key, ssh_priv_key):
-        tenant = ctrlr_inst_info.get('tenant', 'admin')
-        avi_api = ApiSession.get_session(ctrlr_inst_info['api_endpoint'], 
-            ctrlr_inst_info['username'], ctrlr_inst_info['password'], 
-            tenant=tenant)
+        """
+        Brings seproperties, the network, IPAM profile, cloud connector
+        user, cloud and its SE group to the state config.yaml describes.
+        Only objects that differ are written, and only the fields that do.
+        """
+        avi_api = self._avi(ctrlr_inst_info)
 
         resp = avi_api.get('seproperties')
         if resp.status_code != 200:
             self.log.warn('Error getting seproperties %d' % resp.status_code)
             return
-        se_prop_obj = json.loads(resp.text)
-        se_prop_obj['se_runtime_properties']['se_handle_interface_routes'] = True
-        se_prop_obj['se_runtime_properties']['global_mtu'] = 1400
-        put_rsp = avi_api.put('seproperties/%s' % se_prop_obj['uuid'], data=se_prop_obj)
-        self.log.info('Updated seproperties obj status %d %s' % 
-                      (put_rsp.status_code, put_rsp.text))
+        avi_api.ensure('seproperties', {'se_runtime_properties':
+            {'se_handle_interface_routes': True, 'global_mtu': 1400}},
+            json.loads(resp.text))
 
         net_obj_name = ctrlr_inst_info.get('network', 'perf-network')
-        net_obj = avi_api.get_object_by_name('network', net_obj_name)
+        ipam_subnet = ctrlr_inst_info['ipam_subnet'].split('/')
+        net_obj = avi_api.ensure('network', {'name': net_obj_name,
+            'configured_subnets': [{'prefix': {'ip_addr': {'addr':
+            ipam_subnet[0], 'type': 'V4'}, 'mask': int(ipam_subnet[1])},
+            'static_ranges': [{'begin': {'addr': ctrlr_inst_info['ipam_start'],
+            'type': 'V4'}, 'end': {'addr': ctrlr_inst_info['ipam_start'],
+            'type': 'V4'}}]}]},
+            avi_api.get_object_by_name('network', net_obj_name))
         if not net_obj:
-            ipam_subnet = ctrlr_inst_info['ipam_subnet'].split('/')
-            prefix = ipam_subnet[0]
-            mask = ipam_subnet[1]
-            net_obj = {'name': net_obj_name, 'configured_subnets': 
-                [{'prefix': {'ip_addr': {'addr': prefix, 'type': 'V4'},
-                'mask': mask}, 'static_ranges': [{'begin':
-                {'addr': ctrlr_inst_info['ipam_start'], 'type': 'V4'},
-                'end': {'addr': ctrlr_inst_info['ipam_start'], 'type': 'V4'}}]}]}
-            resp = avi_api.post('network', data=net_obj)
-            self.log.info('Created network %s rsp %s' % (net_obj, resp.text))
-            if resp.status_code >= 300:
-                self.log.warn('Error creating network obj %s' % resp.status_code)
-                return
-            net_obj = avi_api.get_object_by_name('network', net_obj_name)
+            return
 
         ipam_obj_name = ctrlr_inst_info.get('ipamdnsproviderprofile', 'perf-ipam')
-        ipam_obj = avi_api.get_object_by_name('ipamdnsproviderprofile', 
-                                              ipam_obj_name)
+        ipam_obj = avi_api.ensure('ipamdnsproviderprofile', {'name':
+            ipam_obj_name, 'type': 'IPAMDNS_TYPE_GCP', 'gcp_profile':
+            {'usable_network_refs': [net_obj['url']]}},
+            avi_api.get_object_by_name('ipamdnsproviderprofile',
+                                       ipam_obj_name))
         if not ipam_obj:
-            ipam_obj = {'name': ipam_obj_name, 'type': 'IPAMDNS_TYPE_GCP',
-                'gcp_profile': {'usable_network_refs': [net_obj['url']]}}
-            resp = avi_api.post('ipamdnsproviderprofile', data=ipam_obj)
-            self.log.info('Created GCP IPAM %s rsp %s' % (ipam_obj, resp.text))
-            if resp.status_code >= 300:
-                self.log.warn('Error creating ipam obj %s' % resp.status_code)
-                return
-            ipam_obj = avi_api.get_object_by_name('ipamdnsproviderprofile', 
-                                                  ipam_obj_name)
+            return
 
-        cc_user = avi_api.get_object_by_name('cloudconnectoruser', ssh_user)
+        cc_user = avi_api.ensure('cloudconnectoruser', {'name': ssh_user,
+            'public_key': ssh_pub_key, 'private_key': ssh_priv_key},
+            avi_api.get_object_by_name('cloudconnectoruser', ssh_user),
+            secrets=('private_key',))
         if not cc_user:
-            cc_user = self._create_cc_user(avi_api, ssh_user, ssh_pub_key, 
-                                           ssh_priv_key)
-            if not cc_user:
-                return
+            return
 
         cloud = ctrlr_inst_info.get('cloud', 'Default-Cloud')
-        cloud_obj = avi_api.get_object_by_name('cloud', cloud)
+        cloud_obj = avi_api.ensure('cloud', {'name': cloud,
+            'vtype': 'CLOUD_LINUXSERVER', 'ipam_provider_ref': ipam_obj['url'],
+            'linuxserver_configuration': {'ssh_attr': {'ssh_user': ssh_user}}},
+            avi_api.get_object_by_name('cloud', cloud))
         if not cloud_obj:
-            cloud_obj = {'vtype': 'CLOUD_LINUXSERVER', 'ipam_provider_ref':
-                ipam_obj['url'], 'linuxserver_configuration': {'ssh_attr':
-                    {'ssh_user': ssh_user}}}
-            resp = avi_api.post('cloud', data=cloud_obj)
-            self.log.info('Created cloud %s rsp %s' % (cloud_obj, resp.text))
-            if resp.status_code >= 300:
-                self.log.warn('Error creating cloud obj %s' % resp.status_code)
-                return
-        else:
-            cloud_obj['vtype'] = 'CLOUD_LINUXSERVER'
-            cloud_obj['ipam_provider_ref'] = ipam_obj['url']
-            if 'linuxserver_configuration' not in cloud_obj:
-                cloud_obj['linuxserver_configuration'] = {}
-            cloud_obj['linuxserver_configuration']['ssh_attr'] = \
-                    {'ssh_user': ssh_user}
-            put_rsp = avi_api.put('cloud/%s' % cloud_obj['uuid'], data=cloud_obj)
-            self.log.info('Updated Cloud obj status %d %s' % 
-                          (put_rsp.status_code, put_rsp.text))
+            return
 
-        seg_objs_rsp = avi_api.get('serviceenginegroup')
-        seg_objs = json.loads(seg_objs_rsp.text)
-        seg_obj = next((seg for seg in seg_objs['results'] 
+        seg_desired = {'min_scaleout_per_vs': se_inst_info['instances'],
+                       'max_scaleout_per_vs': se_inst_info['instances'],
+                       'dedicated_dispatcher_core': True}
+        if avi_api.plan and cloud_obj['uuid'].startswith('<new'):
+            self.log.info('plan: serviceenginegroup of new cloud %s: %s' %
+                          (cloud, seg_desired))
+            return
+        seg_objs = self._avi_list(avi_api, 'serviceenginegroup')
+        seg_obj = next((seg for seg in seg_objs or []
                         if cloud_obj['uuid'] in seg['cloud_ref']), None)
         if not seg_obj:
             self.log.warn('Unable to find SEGroup obj for cloud %s',
                           cloud_obj['uuid'])
             return
-        seg_obj['min_scaleout_per_vs'] = se_inst_info['instances']
-        seg_obj['max_scaleout_per_vs'] = se_inst_info['instances']
-        seg_obj['dedicated_dispatcher_core'] = True
-        put_rsp = avi_api.put('serviceenginegroup/%s' % seg_obj['uuid'], 
-                              data=seg_obj)
-        self.log.info('Updated SEGroup obj status %d %s' % 
-                          (put_rsp.status_code, put_rsp.text))
+        avi_api.ensure('serviceenginegroup', seg_desired, seg_obj)
 
     def create_vs(self, ctrlr_inst_info, pool_inst_info, 
                  pool_prefix, num_pool_instances):
-        instances = self.list_instances(pool_inst_info)
-        pool_instances = [i for i in instances if i['name'].startswith(pool_prefix)]
+        """
+        Brings the datascript, pool and virtualservice to the state
+        config.yaml describes, writing only what differs.
+        """
+        pool_instances = self.fleet_instances(pool_inst_info, pool_prefix)
 
         if len(pool_instances) < num_pool_instances:
             self.log.warn('Just %d instances running %d requested' % 
                           (len(pool_instances), num_pool_instances))
             return
-        pool_ips = {i['info']['networkInterfaces'][0]['networkIP'] 
-            for i in pool_instances}
+        pool_ips = {i['ip'] for i in pool_instances}
 
-        tenant = ctrlr_inst_info.get('tenant', 'admin')
-        avi_api = ApiSession.get_session(ctrlr_inst_info['api_endpoint'], 
-            ctrlr_inst_info['username'], ctrlr_inst_info['password'], 
-            tenant=tenant)
+        avi_api = self._avi(ctrlr_inst_info)
 
         ds_name = ctrlr_inst_info.get('datascript', 'perf-vs-datascript')
-        ds_obj = avi_api.get_object_by_name('vsdatascriptset', ds_name)
+        ds_obj = avi_api.ensure('vsdatascriptset', {'name': ds_name,
+            'datascript': [{'evt': 'VS_DATASCRIPT_EVT_HTTP_REQ',
+            'script': 'avi.http.response(200)'}]},
+            avi_api.get_object_by_name('vsdatascriptset', ds_name))
         if not ds_obj:
-            ds_obj = {'name': ds_name, 'datascript': [{'evt': 
-                'VS_DATASCRIPT_EVT_HTTP_REQ', 'script': 'avi.http.response(200)'}]}
-            resp = avi_api.post('vsdatascriptset', data=ds_obj)
-            self.log.info('Created DataScript %s rsp %s' % (ds_obj, resp.text))
-            if resp.status_code >= 300:
-                self.log.warn('Error creating DataScript obj %s' % resp.status_code)
-                return
-        else:
-            ds_obj['name'] = ds_name
-            ds_obj['datascript'] = [{'evt': 'VS_DATASCRIPT_EVT_HTTP_REQ', \
-                'script': 'avi.http.response(200)'}]
-            put_rsp = avi_api.put('vsdatascriptset/%s' % ds_obj['uuid'], 
-                              data=ds_obj)
-            self.log.info('Updated DataScript obj status %d %s' % 
-                          (put_rsp.status_code, put_rsp.text))
-        ds_obj = avi_api.get_object_by_name('vsdatascriptset', ds_name)
+            return
 
         sslcert_name = ctrlr_inst_info.get('ssl_cert', None)
         if sslcert_name:
@@ -791,26 +1629,14 @@ class gcp(Cloud):
                 return
 
         pool_name = pool_inst_info.get('name', 'perf-pool')
-        pool_obj = avi_api.get_object_by_name('pool', pool_name)
         servers = [{'ip': {'type': 'V4', 'addr': i}, 'port': 80} \
                   for i in pool_ips]
+        pool_obj = avi_api.ensure('pool', {'name': pool_name,
+            'servers': servers}, avi_api.get_object_by_name('pool', pool_name))
         if not pool_obj:
-            pool_obj = {'name': pool_name, 'servers': servers}
-            resp = avi_api.post('pool', data=pool_obj)
-            self.log.info('Created Pool %s rsp %s' % (pool_obj, resp.text))
-            if resp.status_code >= 300:
-                self.log.warn('Error creating Pool obj %s' % resp.status_code)
-                return
-        else:
-            pool_obj['servers'] = servers
-            put_rsp = avi_api.put('pool/%s' % pool_obj['uuid'], 
-                              data=pool_obj)
-            self.log.info('Updated pool obj status %d %s' % 
-                          (put_rsp.status_code, put_rsp.text))
-        pool_obj = avi_api.get_object_by_name('pool', pool_name)
+            return
 
         vs_name = ctrlr_inst_info.get('virtualservice', 'perf-vs')
-        vs_obj = avi_api.get_object_by_name('virtualservice', vs_name)
         if sslcert_name:
             service = {'port': ctrlr_inst_info['port'], 'enable_ssl': True}
         else:
@@ -820,44 +1646,21 @@ class gcp(Cloud):
                 'full_client_logs': {'duration': 0, 'enabled': False}}
         placement_subnet_l = ctrlr_inst_info['placement_subnet'].split('/')
         placement_subnet = {'ip_addr': {'addr': placement_subnet_l[0], 
-            'type': 'V4'}, 'mask': placement_subnet_l[1]}
-        if not vs_obj:
-            vs_obj = {'name': vs_name, 'ip_address': {'addr': 
-                ctrlr_inst_info['vip'], 'type': 'V4'}, 'services':
-                [service], 'analytics_policy': analytics_policy,
-                'scaleout_ecmp': True, 'vs_datascripts': [{'index': 1,
-                'vs_datascript_set_ref': ds_obj['url']}], 'pool_ref': 
-                pool_obj['url'], 'subnet': placement_subnet, 
-                'ign_pool_net_reach': True}
-            if sslcert_name:
-                vs_obj['ssl_key_and_certificate_refs'] = [sslcert['url']]
-            resp = avi_api.post('virtualservice', data=vs_obj)
-            self.log.info('Created VirtualService %s rsp %s' % (vs_obj, resp.text))
-            if resp.status_code >= 300:
-                self.log.warn('Error creating VirtualService obj %s' % resp.status_code)
-                return
-        else:
-            vs_obj['ip_address'] = {'addr': ctrlr_inst_info['vip'], 'type': 'V4'}
-            vs_obj['services'] = [service]
-            vs_obj['analytics_policy'] = analytics_policy
-            vs_obj['scaleout_ecmp'] = True
-            vs_obj['vs_datascripts'] = [{'index': 1, 'vs_datascript_set_ref': 
-                ds_obj['url']}]
-            if sslcert_name:
-                vs_obj['ssl_key_and_certificate_refs'] = [sslcert['url']]
-            vs_obj['pool_ref'] = pool_obj['url']
-            vs_obj['subnet'] = placement_subnet
-            vs_obj['ign_pool_net_reach'] = True
-            put_rsp = avi_api.put('virtualservice/%s' % vs_obj['uuid'], 
-                              data=vs_obj)
-            self.log.info('Updated VirtualService obj status %d %s' % 
-                          (put_rsp.status_code, put_rsp.text))
+            'type': 'V4'}, 'mask': int(placement_subnet_l[1])}
+        vs_obj = {'name': vs_name, 'ip_address': {'addr': 
+            ctrlr_inst_info['vip'], 'type': 'V4'}, 'services':
+            [service], 'analytics_policy': analytics_policy,
+            'scaleout_ecmp': True, 'vs_datascripts': [{'index': 1,
+            'vs_datascript_set_ref': ds_obj['url']}], 'pool_ref': 
+            pool_obj['url'], 'subnet': placement_subnet, 
+            'ign_pool_net_reach': True}
+        if sslcert_name:
+            vs_obj['ssl_key_and_certificate_refs'] = [sslcert['url']]
+        avi_api.ensure('virtualservice', vs_obj,
+                       avi_api.get_object_by_name('virtualservice', vs_name))
 
     def delete_vs(self, ctrlr_inst_info, pool_inst_info):
-        tenant = ctrlr_inst_info.get('tenant', 'admin')
-        avi_api = ApiSession.get_session(ctrlr_inst_info['api_endpoint'], 
-            ctrlr_inst_info['username'], ctrlr_inst_info['password'], 
-            tenant=tenant)
+        avi_api = self._avi(ctrlr_inst_info)
 
         vs_name = ctrlr_inst_info.get('virtualservice', 'perf-vs')
         try:
@@ -882,10 +1685,7 @@ class gcp(Cloud):
             self.log.info('Delete rsp %s', rsp)
 
     def delete_cloud(self, ctrlr_inst_info, ssh_user):
-        tenant = ctrlr_inst_info.get('tenant', 'admin')
-        avi_api = ApiSession.get_session(ctrlr_inst_info['api_endpoint'], 
-            ctrlr_inst_info['username'], ctrlr_inst_info['password'], 
-            tenant=tenant)
+        avi_api = self._avi(ctrlr_inst_info)
 
         cloud = ctrlr_inst_info.get('cloud', 'Default-Cloud')
         cloud_obj = avi_api.get_object_by_name('cloud', cloud)
@@ -893,11 +1693,12 @@ class gcp(Cloud):
             if ('linuxserver_configuration' in cloud_obj and 
                 cloud_obj['linuxserver_configuration'].get('hosts', [])):
                 self._delete_cc_config_ses(ctrlr_inst_info, avi_api, cloud_obj)
-            cloud_obj = avi_api.get_object_by_name('cloud', cloud)
+                # the cached cloud is what that update returned
+                cloud_obj = avi_api.get_object_by_name('cloud', cloud)
             cloud_obj['type'] = 'CLOUD_NONE'
             cloud_obj.pop('ipam_provider_ref', None)
             cloud_obj.pop('linuxserver_configuration', None)
-            put_rsp = avi_api.put('cloud/%s' % cloud_obj['uuid'], data=cloud_obj)
+            put_rsp, _ = avi_api.update('cloud', cloud_obj)
             self.log.info('Updated Cloud obj status %d %s' % 
                           (put_rsp.status_code, put_rsp.text))
         ipam_obj_name = ctrlr_inst_info.get('ipamdnsproviderprofile', 'perf-ipam')
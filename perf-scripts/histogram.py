@@ -0,0 +1,76 @@
+"""
+Log-linear latency histogram in the spirit of HDR histograms. Values are
+microseconds, exact below 64us and then split into 32 sub-buckets per
+power of two, so a bucket is never more than ~3% wide. A histogram is a
+sparse {bucket index: count} dict, and merging histograms is exact.
+Shared by tlsload.py on the clients and results.py on the bootstrap host,
+so it has to run on both Python 2 and 3.
+"""
+
+SUB_BUCKETS = 32
+LINEAR_LIMIT = 2 * SUB_BUCKETS
+
+# Upper bounds in ms of the coarse latency buckets clients stream to
+# watchtest as 'lat', cumulative counts with one extra slot for slower ones
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+# Percentiles reported for a histogram
+PERCENTILES = [50, 90, 99, 99.9, 100]
+
+def bucket(us):
+    us = int(us)
+    if us < LINEAR_LIMIT:
+        return max(us, 0)
+    shift = us.bit_length() - LINEAR_LIMIT.bit_length() + 1
+    return LINEAR_LIMIT + (shift - 1) * SUB_BUCKETS + \
+        ((us >> shift) - SUB_BUCKETS)
+
+def bucket_value(idx):
+    """Highest value in us that falls in bucket idx."""
+    if idx < LINEAR_LIMIT:
+        return idx
+    shift = (idx - LINEAR_LIMIT) // SUB_BUCKETS + 1
+    sub = (idx - LINEAR_LIMIT) % SUB_BUCKETS + SUB_BUCKETS
+    return ((sub + 1) << shift) - 1
+
+def record(hist, us):
+    idx = bucket(us)
+    hist[idx] = hist.get(idx, 0) + 1
+
+def merge(hists):
+    merged = {}
+    for h in hists:
+        for idx, n in h.items():
+            idx = int(idx)
+            merged[idx] = merged.get(idx, 0) + n
+    return merged
+
+def percentiles(hist, pcts=PERCENTILES):
+    """{pct: ms} for each pct, empty if the histogram is."""
+    total = sum(hist.values())
+    res = {}
+    if not total:
+        return res
+    items = sorted((int(i), n) for i, n in hist.items())
+    for pct in pcts:
+        rank = total * pct / 100.0
+        seen = 0
+        for idx, n in items:
+            seen = seen + n
+            if seen >= rank:
+                break
+        res[pct] = bucket_value(idx) / 1000.0
+    return res
+
+def coarse(hist):
+    """Counts per LATENCY_BUCKETS_MS bound, plus one for slower values."""
+    counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    for idx, n in hist.items():
+        ms = bucket_value(int(idx)) / 1000.0
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if ms <= bound:
+                break
+        else:
+            i = len(LATENCY_BUCKETS_MS)
+        counts[i] = counts[i] + n
+    return counts
@@ -0,0 +1,191 @@
+"""
+Counts, latency histograms and errors for every outbound call a run
+makes (Compute API requests and batches, operation waits, ssh tasks and
+controller requests), per call type and per perf_init action. The action
+is tracked per thread, so createall phases running side by side are kept
+apart; threads that never entered one count toward the run's action. At
+the end of a run the metrics are written as JSON and, optionally, as a
+Prometheus textfile, and a breakdown of where the time went is logged.
+"""
+import json, os, threading, time
+from contextlib import contextmanager
+from histogram import record as hist_record, percentiles, bucket_value
+
+# Upper bounds in seconds of the Prometheus duration buckets
+PROM_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+                120, 300, 600]
+
+def error_kind(error):
+    """Short label for an exception or error string, e.g. HttpError 403."""
+    if isinstance(error, Exception):
+        resp = getattr(error, 'resp', None)
+        status = getattr(resp, 'status', None) if resp is not None else None
+        if status:
+            return '%s %s' % (type(error).__name__, status)
+        return type(error).__name__
+    return str(error)
+
+class Metrics(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.default_action = None
+        # (action, call) -> stats
+        self.calls = {}
+        # action -> [start, end]
+        self.actions = {}
+
+    def current_action(self):
+        return getattr(self.local, 'action', None) or self.default_action \
+            or 'none'
+
+    @contextmanager
+    def action(self, name):
+        """Attributes calls made on this thread to action name."""
+        prev = getattr(self.local, 'action', None)
+        self.local.action = name
+        with self.lock:
+            if self.default_action is None:
+                self.default_action = name
+            span = self.actions.setdefault(name, [time.time(), None])
+        try:
+            yield
+        finally:
+            span[1] = time.time()
+            self.local.action = prev
+
+    def record(self, call, seconds, error=None):
+        """
+        One call of type call. seconds is None for calls whose time is
+        already counted elsewhere, e.g. the requests in a batch.
+        """
+        key = (self.current_action(), call)
+        with self.lock:
+            stats = self.calls.get(key)
+            if stats is None:
+                stats = self.calls[key] = {'count': 0, 'errors': 0,
+                    'error_kinds': {}, 'seconds': 0.0, 'hist': {}}
+            stats['count'] += 1
+            if error:
+                kind = error_kind(error)
+                stats['errors'] += 1
+                stats['error_kinds'][kind] = \
+                    stats['error_kinds'].get(kind, 0) + 1
+            if seconds is not None:
+                stats['seconds'] += seconds
+                hist_record(stats['hist'], seconds * 1e6)
+
+    @contextmanager
+    def timed(self, call):
+        """Records the time the block takes, an error if it raises."""
+        t0 = time.time()
+        try:
+            yield
+        except Exception as e:
+            self.record(call, time.time() - t0, e)
+            raise
+        self.record(call, time.time() - t0)
+
+    def summary(self):
+        with self.lock:
+            out = {}
+            for name, (start, end) in self.actions.items():
+                out[name] = {'seconds': (end or time.time()) - start,
+                             'calls': {}}
+            for (name, call), stats in self.calls.items():
+                action = out.setdefault(name, {'seconds': None, 'calls': {}})
+                s = dict(stats, hist=dict(stats['hist']),
+                         error_kinds=dict(stats['error_kinds']))
+                pcts = percentiles(stats['hist'], [50, 90, 99, 100])
+                s['p50_ms'] = pcts.get(50)
+                s['p90_ms'] = pcts.get(90)
+                s['p99_ms'] = pcts.get(99)
+                s['max_ms'] = pcts.get(100)
+                action['calls'][call] = s
+            return out
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({'time': time.time(), 'actions': self.summary()}, f,
+                      indent=2, sort_keys=True)
+
+    def prometheus(self):
+        """Metrics in the Prometheus text exposition format."""
+        esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"')
+        summary = self.summary()
+        lines = ['# HELP perf_action_duration_seconds Wall time of each '
+                 'perf_init action',
+                 '# TYPE perf_action_duration_seconds gauge']
+        for name in sorted(summary):
+            if summary[name]['seconds'] is not None:
+                lines.append('perf_action_duration_seconds{action="%s"} %f' %
+                             (esc(name), summary[name]['seconds']))
+        rows = sorted((name, call, s) for name in summary
+                      for call, s in summary[name]['calls'].items())
+        lines.extend(['# HELP perf_calls_total Outbound calls',
+                      '# TYPE perf_calls_total counter'])
+        for name, call, s in rows:
+            lines.append('perf_calls_total{action="%s",call="%s"} %d' %
+                         (esc(name), esc(call), s['count']))
+        lines.extend(['# HELP perf_call_errors_total Outbound calls that '
+                      'failed', '# TYPE perf_call_errors_total counter'])
+        for name, call, s in rows:
+            for kind, n in sorted(s['error_kinds'].items()):
+                lines.append('perf_call_errors_total{action="%s",call="%s",'
+                             'error="%s"} %d' % (esc(name), esc(call),
+                             esc(kind), n))
+        lines.extend(['# HELP perf_call_duration_seconds Outbound call '
+                      'latency', '# TYPE perf_call_duration_seconds '
+                      'histogram'])
+        for name, call, s in rows:
+            labels = 'action="%s",call="%s"' % (esc(name), esc(call))
+            values = sorted((bucket_value(int(idx)) / 1e6, n)
+                            for idx, n in s['hist'].items())
+            for bound in PROM_BUCKETS:
+                lines.append('perf_call_duration_seconds_bucket{%s,le="%g"} '
+                             '%d' % (labels, bound, sum(n for v, n in values
+                                                        if v <= bound)))
+            timed = sum(s['hist'].values())
+            lines.append('perf_call_duration_seconds_bucket{%s,le="+Inf"} %d'
+                         % (labels, timed))
+            lines.append('perf_call_duration_seconds_sum{%s} %f' %
+                         (labels, s['seconds']))
+            lines.append('perf_call_duration_seconds_count{%s} %d' %
+                         (labels, timed))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        # written aside and renamed, so a textfile collector never sees
+        # half a file
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus())
+        os.rename(tmp, path)
+
+    def breakdown(self):
+        """Lines telling where each action's time went, slowest first."""
+        lines = []
+        summary = self.summary()
+        for name in sorted(summary):
+            action = summary[name]
+            if not action['calls']:
+                continue
+            if action['seconds'] is not None:
+                lines.append('%s: %.1fs' % (name, action['seconds']))
+            else:
+                lines.append('%s:' % name)
+            lines.append('  %-40s %7s %6s %9s %9s %9s' % ('call', 'count',
+                         'errors', 'total s', 'p50 ms', 'p99 ms'))
+            for call, s in sorted(action['calls'].items(),
+                                  key=lambda c: -c[1]['seconds']):
+                lines.append('  %-40s %7d %6d %9.2f %9s %9s%s' % (call,
+                    s['count'], s['errors'], s['seconds'],
+                    '%.1f' % s['p50_ms'] if s['p50_ms'] is not None else '-',
+                    '%.1f' % s['p99_ms'] if s['p99_ms'] is not None else '-',
+                    '  %s' % ', '.join('%s: %d' % e for e in
+                                       sorted(s['error_kinds'].items()))
+                    if s['errors'] else ''))
+        return lines
+
+# The run's metrics, shared by every module that makes outbound calls
+metrics = Metrics()
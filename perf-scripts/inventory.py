@@ -0,0 +1,85 @@
+import json, os, time, traceback, threading
+
+class Inventory(object):
+    """
+    Local index of the fleet, keyed by role prefix (e.g. aviuser-test-client-).
+    Each role holds name -> {'ip', 'status'} and the time it was last
+    reconciled against the cloud. It is kept in a JSON file so every
+    perf_init action can find the fleet without a cloud list call.
+    """
+    def __init__(self, path, ttl, log):
+        self.path = path
+        self.ttl = ttl
+        self.log = log
+        self.roles = {}
+        self.lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self.roles = json.load(f)
+        except Exception:
+            self.log.warn('Unable to read inventory %s %s' % (self.path,
+                          traceback.format_exc()))
+            self.roles = {}
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with self.lock:
+            try:
+                with open(tmp, 'w') as f:
+                    json.dump(self.roles, f, indent=2, sort_keys=True)
+                os.rename(tmp, self.path)
+            except Exception:
+                self.log.warn('Unable to write inventory %s %s' % (self.path,
+                              traceback.format_exc()))
+
+    def is_stale(self, prefix):
+        role = self.roles.get(prefix)
+        if not role:
+            return True
+        return time.time() - role['updated'] > self.ttl
+
+    def instances(self, prefix):
+        """
+        The role's RUNNING instances. Ones on their way up or down are kept
+        in the role but aren't usable hosts.
+        """
+        with self.lock:
+            role = self.roles.get(prefix, {'instances': {}})
+            return [{'name': name, 'ip': i['ip'], 'status': i['status']}
+                    for name, i in sorted(role['instances'].iteritems())
+                    if i['status'] == 'RUNNING']
+
+    def reconcile(self, prefix, instances, fresh=True):
+        """
+        Replaces the role with what the cloud just reported. Without fresh
+        the role stays stale, for instances still on their way up, so the
+        next lookup lists the cloud again.
+        """
+        with self.lock:
+            self.roles[prefix] = {'updated': time.time() if fresh else 0,
+                                  'instances': {}}
+            self.add(prefix, instances)
+
+    def add(self, prefix, instances):
+        with self.lock:
+            role = self.roles.setdefault(prefix, {'updated': 0,
+                                                  'instances': {}})
+            for i in instances:
+                role['instances'][i['name']] = {'ip': i['ip'],
+                                                'status': i['status']}
+            self.save()
+
+    def remove(self, prefix, names=None):
+        """Drops the given names from the role, or the whole role."""
+        with self.lock:
+            if names is None:
+                self.roles.pop(prefix, None)
+            elif prefix in self.roles:
+                for name in names:
+                    self.roles[prefix]['instances'].pop(name, None)
+            self.save()
@@ -0,0 +1,150 @@
+import os
+from results import parse_ab_output, parse_wrk_output, parse_h2load_output, \
+    parse_tlsload_output
+
+class LoadDriver(object):
+    """
+    A load generator run on the clients. A driver knows how to install the
+    tool, the commands that start one or more processes of it against the
+    VIP, how to stop them so they print their summary, and how to parse
+    that summary. Options come from driver_options in the client section.
+    """
+    name = None
+    process = None
+    install_cmd = None
+    # succeeds when install_cmd has nothing left to do
+    check_cmd = None
+    # local files the commands need, uploaded to /tmp on the clients
+    files = []
+    # streams its own counters to the watchtest collector
+    reports_stats = False
+
+    def __init__(self, options=None):
+        self.options = options or {}
+
+    def commands(self, vip, client_threads, collector=None):
+        """
+        Shell commands to start, one per process. collector is the
+        watchtest ip:port, for drivers that report stats.
+        """
+        raise NotImplementedError
+
+    def stop_cmd(self):
+        # SIGINT makes ab and wrk print what they have so far; give them a
+        # moment to write it before making sure they are gone
+        return ('killall -INT %s; for i in $(seq 30); do pgrep -x %s > '
+                '/dev/null || break; sleep 1; done; killall %s' %
+                (self.process, self.process, self.process))
+
+    def parse(self, text):
+        raise NotImplementedError
+
+class AbDriver(LoadDriver):
+    """ab is single threaded, so it runs one process per client thread."""
+    name = 'ab'
+    process = 'ab'
+    install_cmd = 'yum install -y httpd-tools psmisc'
+    check_cmd = 'rpm -q httpd-tools psmisc'
+
+    def commands(self, vip, client_threads, collector=None):
+        cmd = 'ab -r -c %d -n %d' % (self.options.get('concurrency', 100),
+                                     self.options.get('requests', 100000000))
+        if self.options.get('keepalive', False):
+            cmd = cmd + ' -k'
+        return ['%s https://%s/' % (cmd, vip)] * client_threads
+
+    def parse(self, text):
+        return parse_ab_output(text)
+
+class WrkDriver(LoadDriver):
+    """
+    wrk is multi threaded and keeps connections alive, so one process runs
+    with a thread per client thread. keepalive: false sends Connection:
+    close, which makes every request a new TLS handshake.
+    """
+    name = 'wrk'
+    process = 'wrk'
+    install_cmd = 'yum install -y epel-release psmisc && yum install -y wrk'
+    check_cmd = 'rpm -q psmisc wrk'
+
+    def commands(self, vip, client_threads, collector=None):
+        cmd = 'wrk --latency -t %d -c %d -d %ds' % (client_threads,
+            self.options.get('concurrency', 100 * client_threads),
+            self.options.get('duration', 86400))
+        if not self.options.get('keepalive', True):
+            cmd = cmd + " -H 'Connection: close'"
+        return ['%s https://%s/' % (cmd, vip)]
+
+    def parse(self, text):
+        return parse_wrk_output(text)
+
+class H2loadDriver(LoadDriver):
+    """
+    h2load, HTTP/2 by default or HTTP/1.1 with protocol: h1. It prints its
+    summary only when its duration runs out, so stoptest before then
+    reports nothing for it.
+    """
+    name = 'h2load'
+    process = 'h2load'
+    install_cmd = 'yum install -y epel-release psmisc && yum install -y nghttp2'
+    check_cmd = 'rpm -q psmisc nghttp2'
+
+    def commands(self, vip, client_threads, collector=None):
+        cmd = 'h2load -t %d -c %d -m %d -D %d' % (client_threads,
+            self.options.get('concurrency', 100 * client_threads),
+            self.options.get('streams', 1), self.options.get('duration', 600))
+        if self.options.get('protocol', 'h2') == 'h1':
+            cmd = cmd + ' --h1'
+        return ['%s https://%s/' % (cmd, vip)]
+
+    def parse(self, text):
+        return parse_h2load_output(text)
+
+class TlsloadDriver(LoadDriver):
+    """
+    tlsload.py, the built in asyncio TLS load generator. One process with a
+    worker per client thread; mode is handshake, resume or keepalive. It
+    streams counters and latency to watchtest itself and its histograms
+    merge exactly across clients.
+    """
+    name = 'tlsload'
+    process = 'tlsload.py'
+    install_cmd = 'yum install -y python3'
+    check_cmd = 'rpm -q python3'
+    files = [os.path.join(os.path.dirname(os.path.abspath(__file__)), f)
+             for f in ['tlsload.py', 'histogram.py']]
+    reports_stats = True
+
+    def commands(self, vip, client_threads, collector=None):
+        cmd = 'python3 /tmp/tlsload.py --url https://%s/ --mode %s ' \
+              '--workers %d --concurrency %d --duration %d' % (vip,
+              self.options.get('mode', 'handshake'), client_threads,
+              self.options.get('concurrency', 100),
+              self.options.get('duration', 0))
+        if 'max_tls' in self.options:
+            cmd = cmd + ' --max-tls %s' % self.options['max_tls']
+        if 'ciphers' in self.options:
+            cmd = cmd + " --ciphers '%s'" % self.options['ciphers']
+        if collector:
+            cmd = cmd + ' --collector %s' % collector
+        return [cmd]
+
+    def stop_cmd(self):
+        # [t] keeps pkill from matching the shell running this command
+        return ('pkill -INT -f "[t]lsload.py"; for i in $(seq 30); do pgrep '
+                '-f "[t]lsload.py" > /dev/null || break; sleep 1; done; '
+                'pkill -f "[t]lsload.py"')
+
+    def parse(self, text):
+        return parse_tlsload_output(text)
+
+DRIVERS = {d.name: d for d in [AbDriver, WrkDriver, H2loadDriver,
+                               TlsloadDriver]}
+
+def get_driver(inst_info):
+    """Driver named by driver in the client section, ab by default."""
+    name = inst_info.get('driver', 'ab')
+    if name not in DRIVERS:
+        raise ValueError('Unknown load driver %s, one of %s' % (name,
+                         ', '.join(sorted(DRIVERS))))
+    return DRIVERS[name](inst_info.get('driver_options', {}))
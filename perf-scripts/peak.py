@@ -0,0 +1,64 @@
+"""
+Search for the highest load the VIP sustains within a latency SLO. Load
+is set by the number of active clients and the processes (or threads) per
+client. The search doubles the clients until a probe breaks the SLO,
+bisects between the last good and first bad client count, then bisects
+the processes per client at the bad count to land between the two.
+"""
+
+def slo_violation(point, slo):
+    """Why point breaks slo, None if it doesn't."""
+    if point['requests'] == 0:
+        return 'no requests completed'
+    if 'max_error_rate' in slo and \
+            point['error_rate'] > slo['max_error_rate']:
+        return 'error rate %.2f%% over %.2f%%' % (100.0 * point['error_rate'],
+                                                 100.0 * slo['max_error_rate'])
+    if 'max_p99_ms' in slo and point['p99'] is not None and \
+            point['p99'] > slo['max_p99_ms']:
+        return 'p99 %sms over %sms' % (point['p99'], slo['max_p99_ms'])
+    return None
+
+def find_peak(probe, num_clients, threads, start=1):
+    """
+    probe(clients, threads) runs load at that level and returns a point
+    with 'pass' and 'tps'. Returns (peak, probes), peak being the passing
+    probe with the highest tps or None, probes every point in order.
+    """
+    probes = []
+    cache = {}
+
+    def passes(c, t):
+        if (c, t) not in cache:
+            cache[(c, t)] = probe(c, t)
+            probes.append(cache[(c, t)])
+        return cache[(c, t)]['pass']
+
+    good, bad = 0, num_clients + 1
+    c = max(1, min(start, num_clients))
+    while True:
+        if not passes(c, threads):
+            bad = c
+            break
+        good = c
+        if c == num_clients:
+            break
+        c = min(c * 2, num_clients)
+    while bad - good > 1:
+        mid = (good + bad) // 2
+        if passes(mid, threads):
+            good = mid
+        else:
+            bad = mid
+    if bad <= num_clients and threads > 1:
+        # bad clients at fewer threads each, between good and bad offered
+        lo, hi = threads * good // bad, threads
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if passes(bad, mid):
+                lo = mid
+            else:
+                hi = mid
+    passed = [p for p in probes if p['pass']]
+    peak = max(passed, key=lambda p: p['tps']) if passed else None
+    return peak, probes
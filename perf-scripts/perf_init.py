@@ -1,15 +1,18 @@
 #!/usr/bin/python
 
-import logging, sys, argparse, json, yaml, os, traceback
+import logging, sys, argparse, json, yaml, os, traceback, threading, time
 from gcp import gcp
+from instrument import metrics
 
 def deleteclient(cloud_obj, log):
     prefix = '%sclient-' % cloud_obj.cloud['clouddata']['prefix']
-    cloud_obj.delete_instances(cloud_obj.cloud['clouddata']['client'], prefix)
+    cloud_obj.delete_instances(cloud_obj.cloud['clouddata']['client'], prefix,
+                               wait=True)
 
 def deletepool(cloud_obj, log):
     prefix = '%spool-' % cloud_obj.cloud['clouddata']['prefix']
-    cloud_obj.delete_instances(cloud_obj.cloud['clouddata']['pool'], prefix)
+    cloud_obj.delete_instances(cloud_obj.cloud['clouddata']['pool'], prefix,
+                               wait=True)
 
 def starttest(cloud_obj, log):
     prefix = '%sclient-' % cloud_obj.cloud['clouddata']['prefix']
@@ -22,6 +25,17 @@ def stoptest(cloud_obj, log):
     prefix = '%sclient-' % cloud_obj.cloud['clouddata']['prefix']
     cloud_obj.stop_test(cloud_obj.cloud['clouddata']['client'], prefix)
 
+def watchtest(cloud_obj, log, duration=0):
+    prefix = '%sclient-' % cloud_obj.cloud['clouddata']['prefix']
+    cloud_obj.watch_test(cloud_obj.cloud['clouddata']['client'], prefix,
+                         duration)
+
+def findpeak(cloud_obj, log):
+    prefix = '%sclient-' % cloud_obj.cloud['clouddata']['prefix']
+    cloud_obj.find_peak(cloud_obj.cloud['clouddata']['client'],
+                        cloud_obj.cloud['clouddata']['avicontroller']['vip'],
+                        prefix)
+
 def createclient(cloud_obj, log):
     prefix = '%sclient-' % cloud_obj.cloud['clouddata']['prefix']
     num_instances = cloud_obj.cloud['clouddata']['client'].get('instances', 1)
@@ -52,6 +66,13 @@ def createse(cloud_obj, log):
             cloud_obj.cloud['clouddata']['ssh_private_key'])
     log.info('Num SE instances running %d prefix %s' % (n, prefix))
 
+def createsevms(cloud_obj, log):
+    prefix = '%savise-' % cloud_obj.cloud['clouddata']['prefix']
+    num_instances = cloud_obj.cloud['clouddata']['avise'].get('instances', 1)
+    cloud_obj.create_se_instances(cloud_obj.cloud['clouddata']['avise'],
+            prefix, num_instances, cloud_obj.cloud['clouddata']['ssh_username'],
+            cloud_obj.cloud['clouddata']['ssh_public_key'])
+
 def createvs(cloud_obj, log):
     pool_prefix = '%spool-' % cloud_obj.cloud['clouddata']['prefix']
     n_pool_instances = cloud_obj.cloud['clouddata']['pool'].get('instances', 1)
@@ -73,19 +94,111 @@ def deletecloud(cloud_obj, log):
     cloud_obj.delete_cloud(cloud_obj.cloud['clouddata']['avicontroller'],
             cloud_obj.cloud['clouddata']['ssh_username'])
 
+def run_phases(phases, cloud_obj, log):
+    """
+    Runs (name, fn, deps) phases, each on its own thread as soon as all of
+    its deps are done. Phases whose deps failed are skipped. Logs the wall
+    time of every phase and the critical path through them.
+    """
+    t0 = time.time()
+    cond = threading.Condition()
+    state = {}
+    times = {}
+
+    def _run(name, fn):
+        start = time.time()
+        status = 'done'
+        try:
+            with metrics.action(name):
+                fn(cloud_obj, log)
+        except Exception:
+            log.error('Phase %s failed %s' % (name, traceback.format_exc()))
+            status = 'failed'
+        with cond:
+            state[name] = status
+            times[name] = (start - t0, time.time() - t0)
+            cond.notify_all()
+
+    with cond:
+        while True:
+            for name, fn, deps in phases:
+                if name in state:
+                    continue
+                dep_states = [state.get(d) for d in deps]
+                if any(st in ('failed', 'skipped') for st in dep_states):
+                    log.warn('Skipping phase %s, a dependency failed' % name)
+                    state[name] = 'skipped'
+                    times[name] = (time.time() - t0, time.time() - t0)
+                    cond.notify_all()
+                elif all(st == 'done' for st in dep_states):
+                    log.info('Starting phase %s' % name)
+                    state[name] = 'running'
+                    t = threading.Thread(target=_run, args=(name, fn),
+                                         name=name)
+                    t.daemon = True
+                    t.start()
+            if all(state.get(name) in ('done', 'failed', 'skipped')
+                   for name, _, _ in phases):
+                break
+            cond.wait(1)
+
+    deps = {name: d for name, _, d in phases}
+    path = [max(times, key=lambda n: times[n][1])]
+    while deps[path[0]]:
+        path.insert(0, max(deps[path[0]], key=lambda n: times[n][1]))
+    log.info('%-14s %8s %8s %8s  %s' % ('phase', 'start', 'end', 'wall',
+             'status'))
+    for name in sorted(times, key=lambda n: times[n]):
+        start, end = times[name]
+        log.info('%-14s %8.1f %8.1f %8.1f  %s' % (name, start, end,
+                 end - start, state[name]))
+    log.info('Total %.1fs, critical path %s' % (time.time() - t0,
+             ' -> '.join(path)))
+    return state
+
+def report_metrics(cloud_obj, log, action):
+    """
+    Logs where the run's time went and saves its call metrics as JSON,
+    and as a Prometheus textfile when clouddata metrics_textfile is set.
+    """
+    for line in metrics.breakdown():
+        log.info(line)
+    clouddata = cloud_obj.cloud['clouddata']
+    metrics_file = clouddata.get('metrics_file', 'perf-metrics-%s-%s.json' %
+                                 (action, time.strftime('%Y%m%d-%H%M%S')))
+    try:
+        metrics.write_json(metrics_file)
+        log.info('Metrics saved in %s' % metrics_file)
+    except Exception:
+        log.warn('Unable to save metrics %s %s' % (metrics_file,
+                 traceback.format_exc()))
+    textfile = clouddata.get('metrics_textfile')
+    if textfile:
+        try:
+            metrics.write_prometheus(textfile)
+        except Exception:
+            log.warn('Unable to write metrics textfile %s %s' % (textfile,
+                     traceback.format_exc()))
+
 def createall(cloud_obj, log):
-    createcloud(cloud_obj, log)
-    createpool(cloud_obj, log)
-    createse(cloud_obj, log)
-    createvs(cloud_obj, log)
-    createclient(cloud_obj, log)
+    # VM provisioning for pool, SE and client roles runs in parallel, the
+    # controller steps wait only for what they actually use
+    run_phases([('createcloud', createcloud, []),
+                ('createpool', createpool, []),
+                ('createsevms', createsevms, []),
+                ('createclient', createclient, []),
+                ('createse', createse, ['createcloud', 'createsevms']),
+                ('createvs', createvs, ['createcloud', 'createpool',
+                                        'createse'])],
+               cloud_obj, log)
 
 def deleteall(cloud_obj, log):
-    deleteclient(cloud_obj, log)
-    deletevs(cloud_obj, log)
-    deletepool(cloud_obj, log)
-    deletese(cloud_obj, log)
-    deletecloud(cloud_obj, log)
+    run_phases([('deleteclient', deleteclient, []),
+                ('deletevs', deletevs, []),
+                ('deletepool', deletepool, []),
+                ('deletese', deletese, ['deletevs']),
+                ('deletecloud', deletecloud, ['deletese'])],
+               cloud_obj, log)
 
 if __name__ == "__main__":
     logger = logging.getLogger(__name__)
@@ -97,13 +210,22 @@ if __name__ == "__main__":
     logger.addHandler(ch)
 
     parser = argparse.ArgumentParser(description='Avi Performance Gen')
-    action_choices = ['createall', 'createcloud', 'createvs', 'createclient', 'createse', 'createpool', 'deletevs', 'starttest', 'stoptest', 'deleteclient', 'deletese', 'deletepool', 'deletecloud', 'deleteall']
+    action_choices = ['createall', 'createcloud', 'createvs', 'createclient', 'createse', 'createsevms', 'createpool', 'deletevs', 'starttest', 'stoptest', 'watchtest', 'findpeak', 'deleteclient', 'deletese', 'deletepool', 'deletecloud', 'deleteall']
     parser.add_argument('--action', '-a', action='store', required=True,
-                        help='action - one of createall|createcloud|createclient|createse|starttest|stoptest|deleteall|deletecloud|deleteclient|deletese',
+                        help='action - one of createall|createcloud|createclient|createse|starttest|stoptest|watchtest|findpeak|deleteall|deletecloud|deleteclient|deletese',
                         choices=action_choices)
     parser.add_argument('--file', '-f', action='store', required=True,
                         help='config file in YAML or JSON format')
+    parser.add_argument('--duration', '-d', action='store', type=int,
+                        default=0,
+                        help='watchtest duration in seconds, 0 runs until interrupted')
+    parser.add_argument('--reconcile', '-r', action='store_true',
+                        help='refresh the local fleet inventory from the cloud')
+    parser.add_argument('--plan', '-p', action='store_true',
+                        help='createcloud and createvs only log the controller changes they would make')
     args = parser.parse_args()
+    if args.plan and args.action not in ['createcloud', 'createvs']:
+        parser.error('--plan works with createcloud and createvs')
 
     filename, file_extension = os.path.splitext(args.file)
     if file_extension == '.yaml':
@@ -129,33 +251,47 @@ if __name__ == "__main__":
     if cloud_data['clouddata']['kind'] == 'azure':
         cloud_obj = azure(cloud_data, logger)
 
-    if args.action == 'createclient':
-        createclient(cloud_obj, logger)
-    elif args.action == 'createse':
-        createse(cloud_obj, logger)
-    elif args.action == 'createvs':
-        createvs(cloud_obj, logger)
-    elif args.action == 'createpool':
-        createpool(cloud_obj, logger)
-    elif args.action == 'createcloud':
-        createcloud(cloud_obj, logger)
-    elif args.action == 'createall':
-        createall(cloud_obj, logger)
-    elif args.action == 'starttest':
-        starttest(cloud_obj, logger)
-    elif args.action == 'stoptest':
-        stoptest(cloud_obj, logger)
-    elif args.action == 'deletese':
-        deletese(cloud_obj, logger)
-    elif args.action == 'deleteclient':
-        deleteclient(cloud_obj, logger)
-    elif args.action == 'deletevs':
-        deletevs(cloud_obj, logger)
-    elif args.action == 'deletepool':
-        deletepool(cloud_obj, logger)
-    elif args.action == 'deletecloud':
-        deletecloud(cloud_obj, logger)
-    elif args.action == 'deleteall':
-        deleteall(cloud_obj, logger)
-    else:
-        logger.error('Unsupported option %s' % args.action)
+    cloud_obj.inventory_reconcile = args.reconcile
+    cloud_obj.avi_plan = args.plan
+
+    try:
+        with metrics.action(args.action):
+            if args.action == 'createclient':
+                createclient(cloud_obj, logger)
+            elif args.action == 'createse':
+                createse(cloud_obj, logger)
+            elif args.action == 'createsevms':
+                createsevms(cloud_obj, logger)
+            elif args.action == 'createvs':
+                createvs(cloud_obj, logger)
+            elif args.action == 'createpool':
+                createpool(cloud_obj, logger)
+            elif args.action == 'createcloud':
+                createcloud(cloud_obj, logger)
+            elif args.action == 'createall':
+                createall(cloud_obj, logger)
+            elif args.action == 'starttest':
+                starttest(cloud_obj, logger)
+            elif args.action == 'stoptest':
+                stoptest(cloud_obj, logger)
+            elif args.action == 'watchtest':
+                watchtest(cloud_obj, logger, args.duration)
+            elif args.action == 'findpeak':
+                findpeak(cloud_obj, logger)
+            elif args.action == 'deletese':
+                deletese(cloud_obj, logger)
+            elif args.action == 'deleteclient':
+                deleteclient(cloud_obj, logger)
+            elif args.action == 'deletevs':
+                deletevs(cloud_obj, logger)
+            elif args.action == 'deletepool':
+                deletepool(cloud_obj, logger)
+            elif args.action == 'deletecloud':
+                deletecloud(cloud_obj, logger)
+            elif args.action == 'deleteall':
+                deleteall(cloud_obj, logger)
+            else:
+                logger.error('Unsupported option %s' % args.action)
+    finally:
+        cloud_obj.close()
+        report_metrics(cloud_obj, logger, args.action)
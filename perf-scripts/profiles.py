@@ -0,0 +1,86 @@
+"""
+Load profiles for starttest. A profile is a list of stages from
+load_profile in the client section, each a one key dict:
+
+    load_profile:
+      - step: {from: 4, to: 16, by: 4, hold: 60}   # 4, 8, 12, 16 clients
+      - hold: {clients: 16, duration: 300}
+      - ramp: {from: 16, to: 0, duration: 120, interval: 10}
+
+step changes the number of active clients by 'by' and holds each level
+for 'hold' seconds, ramp moves linearly between from and to over duration
+seconds, one level per interval, and hold keeps a level. Going down is a
+ramp or step with from above to. A profile expands into a flat list of
+{'clients', 'hold'} steps the scheduler in start_test carries out.
+"""
+
+def _steps(start, end, by):
+    by = abs(by) if end >= start else -abs(by)
+    levels = list(range(start, end, by))
+    return levels + [end]
+
+def expand_profile(profile, num_clients):
+    """
+    Steps for profile, client counts clamped to num_clients. Raises
+    ValueError for a stage it doesn't know or can't run.
+    """
+    steps = []
+    for stage in profile:
+        if not isinstance(stage, dict) or len(stage) != 1:
+            raise ValueError('Load profile stage %s is not one of step, ramp '
+                             'or hold' % (stage,))
+        kind, opts = list(stage.items())[0]
+        if kind == 'step':
+            if not opts.get('by'):
+                raise ValueError('Load profile step needs by > 0')
+            for n in _steps(opts['from'], opts['to'], opts['by']):
+                steps.append({'clients': n, 'hold': opts['hold']})
+        elif kind == 'ramp':
+            interval = opts.get('interval', 10)
+            levels = max(int(opts['duration'] // interval), 1)
+            for i in range(1, levels + 1):
+                n = opts['from'] + (opts['to'] - opts['from']) * i // levels
+                steps.append({'clients': n, 'hold': interval})
+        elif kind == 'hold':
+            steps.append({'clients': opts['clients'],
+                          'hold': opts['duration']})
+        else:
+            raise ValueError('Unknown load profile stage %s' % kind)
+    for s in steps:
+        s['clients'] = max(0, min(s['clients'], num_clients))
+    return steps
+
+def client_rates(curve, runs):
+    """
+    Fills in each step's tps, requests, error_rate and p99 from the load
+    generators' own results. runs holds (first step, last step, client
+    result) for every client run; a step adds up the runs it falls in, each
+    at its rate averaged over the whole run, since ab and wrk only report
+    when they stop. p99 is the request weighted mean of theirs.
+    """
+    for point in curve:
+        clients = [c for first, last, c in runs
+                   if c and first <= point['step'] <= last]
+        requests = sum(c['requests'] for c in clients)
+        attempts = requests + sum(c['failed'] for c in clients)
+        point['tps'] = sum(c['rps'] for c in clients)
+        point['requests'] = int(point['tps'] * point['hold'])
+        point['error_rate'] = float(attempts - requests) / attempts \
+            if attempts else 0.0
+        have = [c for c in clients if 99 in c['latency']]
+        weight = sum(c['requests'] for c in have)
+        if weight:
+            point['p99'] = sum(c['latency'][99] * c['requests']
+                               for c in have) / float(weight)
+    return curve
+
+def format_curve(curve):
+    """Throughput against offered load, one line per step."""
+    lines = ['%4s %8s %8s %12s %8s %8s' % ('step', 'clients', 'threads',
+             'requests/s', 'errors', 'p99 ms')]
+    for s in curve:
+        lines.append('%4d %8d %8d %12.1f %7.2f%% %8s' % (s['step'],
+                     s['clients'], s['threads'], s['tps'],
+                     100.0 * s['error_rate'],
+                     '-' if s['p99'] is None else '%s' % s['p99']))
+    return lines
@@ -0,0 +1,94 @@
+import threading, time
+
+# Requests/sec added per second of unthrottled traffic, and the factor the
+# rate is cut by when the API says it is over quota
+AIMD_INCREASE = 1.0
+AIMD_DECREASE = 0.5
+
+# Throttled responses within this many seconds of a cut are from requests
+# sent before it, and don't cut the rate again
+DECREASE_COOLDOWN = 2.0
+
+# Seconds between logs of the effective rate
+LOG_INTERVAL = 30
+
+class RateLimiter(object):
+    """
+    Token bucket shared by every thread that calls the API, with the rate
+    adjusted AIMD style: every request that goes through raises it a
+    little, so it climbs by AIMD_INCREASE requests/sec each second, and a
+    rate limit response halves it. It settles just under the quota the
+    API enforces instead of bouncing off it. A caller asking for more
+    tokens than are left (a batch of requests) takes them on credit and
+    waits until they would have been earned, so the average rate holds.
+    """
+    def __init__(self, rate, log, min_rate=1.0, max_rate=None, name='API'):
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate) if max_rate else None
+        self.log = log
+        self.name = name
+        self.lock = threading.Lock()
+        self.tokens = self.rate
+        self.updated = time.time()
+        self.last_decrease = 0
+        self.last_log = time.time()
+        self.requests = 0
+        self.throttled_requests = 0
+        self.waited = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.rate, self.tokens +
+                          (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, n=1):
+        """Waits until n requests may be sent."""
+        with self.lock:
+            now = time.time()
+            self._refill(now)
+            self.tokens = self.tokens - n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.requests = self.requests + n
+            self.waited = self.waited + wait
+        if wait:
+            time.sleep(wait)
+
+    def burst(self):
+        """Most requests to send at once, e.g. in one batch."""
+        with self.lock:
+            return max(1, int(self.rate))
+
+    def succeeded(self, n=1):
+        """n requests went through."""
+        with self.lock:
+            for _ in range(n):
+                self.rate = self.rate + AIMD_INCREASE / self.rate
+            if self.max_rate:
+                self.rate = min(self.rate, self.max_rate)
+            self._log_rate()
+
+    def throttled(self, n=1):
+        """n requests were turned away for being over the rate limit."""
+        with self.lock:
+            self.throttled_requests = self.throttled_requests + n
+            now = time.time()
+            if now - self.last_decrease < DECREASE_COOLDOWN:
+                return
+            self.last_decrease = now
+            prev = self.rate
+            self.rate = max(self.min_rate, self.rate * AIMD_DECREASE)
+            # whatever was saved up went to the requests that got throttled
+            self._refill(now)
+            self.tokens = min(self.tokens, 0)
+            self.log.info('%s rate limited, cutting rate %.1f -> %.1f '
+                          'requests/sec' % (self.name, prev, self.rate))
+
+    def _log_rate(self):
+        now = time.time()
+        if now - self.last_log < LOG_INTERVAL:
+            return
+        self.log.info('%s rate %.1f requests/sec, %d requests %d throttled, '
+                      '%.1fs spent waiting' % (self.name, self.rate,
+                      self.requests, self.throttled_requests, self.waited))
+        self.last_log = now
@@ -0,0 +1,196 @@
+import json, re
+import histogram
+
+# Marker printed before each load generator output file when collecting
+OUTPUT_SEPARATOR = '==> '
+
+_AB_FIELDS = {
+    'requests': r'^Complete requests:\s+(\d+)',
+    'failed': r'^Failed requests:\s+(\d+)',
+    'non_2xx': r'^Non-2xx responses:\s+(\d+)',
+    'rps': r'^Requests per second:\s+([\d.]+)',
+    'time': r'^Time taken for tests:\s+([\d.]+)',
+}
+
+def split_outputs(text):
+    """Splits collected output into one chunk per load generator process."""
+    chunks = []
+    for line in text.splitlines():
+        if line.startswith(OUTPUT_SEPARATOR):
+            chunks.append([])
+        elif chunks:
+            chunks[-1].append(line)
+    return ['\n'.join(c) for c in chunks]
+
+def parse_ab_output(text):
+    """
+    Parses the summary ab prints at exit (or on SIGINT) into
+    {'requests', 'failed', 'rps', 'time', 'latency': {pct: ms}}.
+    Returns None if the text holds no summary.
+    """
+    res = {}
+    for field, regex in _AB_FIELDS.items():
+        m = re.search(regex, text, re.M)
+        if m:
+            res[field] = float(m.group(1)) if '.' in m.group(1) else \
+                int(m.group(1))
+    if 'requests' not in res or 'rps' not in res:
+        return None
+    res['failed'] = res.get('failed', 0) + res.pop('non_2xx', 0)
+    res['latency'] = {}
+    for m in re.finditer(r'^\s*(\d+)%\s+(\d+)', text, re.M):
+        res['latency'][int(m.group(1))] = int(m.group(2))
+    return res
+
+def _to_ms(value, unit):
+    return float(value) * {'us': 0.001, 'ms': 1, 's': 1000, 'm': 60000,
+                           'h': 3600000}[unit]
+
+def parse_wrk_output(text):
+    """
+    Parses wrk --latency output into the same form as parse_ab_output.
+    Failed counts socket errors and non 2xx/3xx responses.
+    """
+    m = re.search(r'^\s*(\d+) requests in ([\d.]+)(\w+)', text, re.M)
+    rps = re.search(r'^Requests/sec:\s+([\d.]+)', text, re.M)
+    if not m or not rps:
+        return None
+    res = {'requests': int(m.group(1)), 'time': _to_ms(m.group(2),
+           m.group(3)) / 1000, 'rps': float(rps.group(1)), 'failed': 0,
+           'latency': {}}
+    errs = re.search(r'Socket errors: connect (\d+), read (\d+), write '
+                     r'(\d+), timeout (\d+)', text)
+    if errs:
+        res['failed'] = sum(int(e) for e in errs.groups())
+    non2xx = re.search(r'Non-2xx or 3xx responses:\s+(\d+)', text)
+    if non2xx:
+        res['failed'] = res['failed'] + int(non2xx.group(1))
+    for m in re.finditer(r'^\s*(\d+)%\s+([\d.]+)(us|ms|s|m)\s*$', text,
+                         re.M):
+        res['latency'][int(m.group(1))] = _to_ms(m.group(2), m.group(3))
+    lat = re.search(r'^\s*Latency\s+\S+\s+\S+\s+([\d.]+)(us|ms|s|m)\s',
+                    text, re.M)
+    if lat:
+        res['latency'][100] = _to_ms(lat.group(1), lat.group(2))
+    return res
+
+def parse_h2load_output(text):
+    """
+    Parses h2load output into the same form as parse_ab_output. h2load has
+    no percentiles, so latency only holds the max (100).
+    """
+    fin = re.search(r'^finished in ([\d.]+)(\w+), ([\d.]+) req/s', text,
+                    re.M)
+    reqs = re.search(r'^requests: (\d+) total, \d+ started, (\d+) done, '
+                     r'(\d+) succeeded', text, re.M)
+    if not fin or not reqs:
+        return None
+    res = {'requests': int(reqs.group(2)), 'time': _to_ms(fin.group(1),
+           fin.group(2)) / 1000, 'rps': float(fin.group(3)),
+           'failed': int(reqs.group(1)) - int(reqs.group(3)), 'latency': {}}
+    lat = re.search(r'^time for request:\s+\S+?\s+([\d.]+)(us|ms|s)', text,
+                    re.M)
+    if lat:
+        res['latency'][100] = _to_ms(lat.group(1), lat.group(2))
+    return res
+
+def parse_tlsload_output(text):
+    """
+    Parses the {"tlsload": summary} line tlsload.py prints at exit into the
+    same form as parse_ab_output, plus its latency histogram and handshake
+    counts.
+    """
+    for line in text.splitlines():
+        if not line.startswith('{"tlsload"'):
+            continue
+        try:
+            s = json.loads(line)['tlsload']
+        except ValueError:
+            return None
+        hist = histogram.merge([s['hist']])
+        return {'requests': s['requests'], 'failed': s['errors'],
+                'rps': s['rps'], 'time': s['time'], 'hist': hist,
+                'handshakes': s['handshakes'], 'resumed': s['resumed'],
+                'latency': histogram.percentiles(hist)}
+    return None
+
+def _merge(results):
+    """
+    Sums counts and rates over results. When every input has a latency
+    histogram the percentiles come from the merged histogram and are exact.
+    Otherwise they can't be merged from summaries, so each one is the
+    request weighted mean of the inputs, except the max, which is the max.
+    """
+    merged = {'processes': sum(r.get('processes', 1) for r in results),
+              'requests': 0, 'failed': 0, 'rps': 0.0, 'latency': {}}
+    for r in results:
+        merged['requests'] += r['requests']
+        merged['failed'] += r['failed']
+        merged['rps'] += r['rps']
+    for key in ['handshakes', 'resumed']:
+        if results and all(key in r for r in results):
+            merged[key] = sum(r[key] for r in results)
+    if results and all('hist' in r for r in results):
+        merged['hist'] = histogram.merge(r['hist'] for r in results)
+        merged['latency'] = histogram.percentiles(merged['hist'])
+        return merged
+    pcts = set()
+    for r in results:
+        pcts.update(r['latency'])
+    for pct in sorted(pcts):
+        have = [r for r in results if pct in r['latency']]
+        if pct == 100:
+            merged['latency'][pct] = max(r['latency'][pct] for r in have)
+            continue
+        weight = sum(r['requests'] for r in have)
+        if weight:
+            merged['latency'][pct] = sum(r['latency'][pct] * r['requests']
+                                         for r in have) / float(weight)
+        else:
+            merged['latency'][pct] = max(r['latency'][pct] for r in have)
+    return merged
+
+def merge_results(outputs, parse=parse_ab_output):
+    """
+    Builds one run result from {host: collected output}. Returns
+    {'total': merged, 'clients': {host: merged}, 'errors': [hosts]} where
+    errors lists hosts whose output had nothing to parse.
+    """
+    run = {'clients': {}, 'errors': []}
+    for host, text in sorted(outputs.items()):
+        procs = [parse(chunk) for chunk in split_outputs(text or '')]
+        procs = [p for p in procs if p]
+        if not procs:
+            run['errors'].append(host)
+            continue
+        run['clients'][host] = _merge(procs)
+    run['total'] = _merge(list(run['clients'].values()))
+    run['total']['clients'] = len(run['clients'])
+    return run
+
+def format_results(run, outlier=0.8):
+    """
+    Human readable summary of a run. Clients below outlier times the median
+    client rps are flagged.
+    """
+    total = run['total']
+    lines = ['%d clients %d processes: %.1f requests/sec, %d requests, '
+             '%d failed' % (total['clients'], total['processes'],
+             total['rps'], total['requests'], total['failed'])]
+    if total['latency']:
+        lines.append('latency ms ' + ' '.join('p%s=%.0f' % (p, v)
+                     for p, v in sorted(total['latency'].items())))
+    clients = sorted(run['clients'].items(), key=lambda c: c[1]['rps'])
+    if clients:
+        median = clients[len(clients) // 2][1]['rps']
+        lines.append('%-16s %6s %12s %12s %8s %8s' % ('client', 'procs',
+                     'requests/s', 'requests', 'failed', 'p99 ms'))
+        for host, c in clients:
+            flag = ' <-- outlier' if c['rps'] < outlier * median else ''
+            lines.append('%-16s %6d %12.1f %12d %8d %8s%s' % (host,
+                         c['processes'], c['rps'], c['requests'], c['failed'],
+                         '%.0f' % c['latency'][99] if 99 in c['latency']
+                         else '-', flag))
+    if run['errors']:
+        lines.append('No results from %s' % ', '.join(run['errors']))
+    return lines
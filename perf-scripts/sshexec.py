@@ -0,0 +1,290 @@
+import errno, fcntl, os, resource, select, shutil, subprocess, tempfile, \
+    threading, time
+
+# Bytes read from or written to a pipe at a time
+CHUNK = 65536
+
+# Seconds an idle master connection lives when it isn't kept across runs,
+# in case close is never reached
+CONTROL_IDLE = 600
+
+class _Sessions(object):
+    """
+    Count of ssh processes open in this process, shared by every executor
+    and every thread fanning out, e.g. createall phases running side by
+    side. limit is the largest concurrency any executor was made with.
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.limit = 0
+        self.open = 0
+
+    def grow(self, limit):
+        with self.cond:
+            self.limit = max(self.limit, limit)
+            self.cond.notify_all()
+            return self.limit
+
+    def acquire(self, block):
+        """Takes a session, waiting for one only when block is set."""
+        with self.cond:
+            while self.open >= self.limit:
+                if not block:
+                    return False
+                self.cond.wait()
+            self.open = self.open + 1
+            return True
+
+    def release(self):
+        with self.cond:
+            self.open = self.open - 1
+            self.cond.notify()
+
+SESSIONS = _Sessions()
+
+class SSHExecutor(object):
+    """
+    Runs a shell command on many hosts at once through the OpenSSH client.
+    One ssh process per host, up to concurrency at a time, all driven from
+    a single poll loop: no threads or forked Python workers, so thousands
+    of hosts cost little more than the ssh processes themselves. Each host
+    gets its own timeout, and run returns a result per host:
+
+        {'host', 'exit', 'stdout', 'stderr', 'duration', 'timeout'}
+
+    exit is None when the command timed out and was killed. stdin, when
+    given, is written to every host's command, which is how files are
+    uploaded.
+
+    The first command to a host opens a master connection that later
+    commands multiplex over, so only the first one pays for the TCP and
+    SSH handshakes. By default masters live in a private directory and
+    close ends them. With control_persist seconds they live in
+    control_dir (~/.ssh by default), stay open that long after their last
+    use and are left open by close, so the next run reuses them too.
+
+    Sessions count against SESSIONS, so commands run at once from several
+    threads together stay within the largest concurrency, and the open
+    file limit is raised to fit it.
+    """
+    def __init__(self, user, key_file, log, concurrency=256, timeout=600,
+                 connect_timeout=30, port=22, control_persist=0,
+                 control_dir=None):
+        self.user = user
+        self.key_file = key_file
+        self.log = log
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.port = port
+        self.control_persist = control_persist
+        if control_persist:
+            self.control_dir = os.path.expanduser(control_dir or '~/.ssh')
+            if not os.path.isdir(self.control_dir):
+                os.makedirs(self.control_dir, 0700)
+        else:
+            self.control_dir = tempfile.mkdtemp(prefix='perf-ssh-')
+        self.contacted = set()
+        self._raise_fd_limit(SESSIONS.grow(concurrency) * 3 + 64)
+
+    def _raise_fd_limit(self, needed):
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY and soft < needed:
+            if hard != resource.RLIM_INFINITY:
+                needed = min(needed, hard)
+            try:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+            except (ValueError, resource.error):
+                self.log.warn('Unable to raise open file limit to %d, ssh '
+                              'concurrency %d may fail' % (needed,
+                              self.concurrency))
+
+    def ssh_options(self):
+        return ['-o', 'BatchMode=yes',
+                '-o', 'StrictHostKeyChecking=no',
+                '-o', 'UserKnownHostsFile=/dev/null',
+                '-o', 'LogLevel=ERROR',
+                '-o', 'ConnectTimeout=%d' % self.connect_timeout,
+                '-o', 'ConnectionAttempts=3',
+                '-o', 'ServerAliveInterval=30',
+                '-o', 'ControlMaster=auto',
+                # %C hashes host, port and user so socket paths stay short
+                '-o', 'ControlPath=%s/cm-%%C' % self.control_dir,
+                '-o', 'ControlPersist=%d' % (self.control_persist or
+                                             CONTROL_IDLE),
+                '-i', self.key_file, '-p', str(self.port)]
+
+    def command(self, host, cmd):
+        """argv that runs cmd on host."""
+        return ['ssh'] + self.ssh_options() + ['%s@%s' % (self.user, host),
+                                               cmd]
+
+    def exit_command(self, host):
+        """argv that closes the master connection to host."""
+        return ['ssh'] + self.ssh_options() + ['-O', 'exit',
+                                               '%s@%s' % (self.user, host)]
+
+    def close(self):
+        """
+        Ends the master connections this run opened, unless they are kept
+        across runs.
+        """
+        if self.control_persist or not self.contacted:
+            return
+        hosts = sorted(self.contacted)
+        self.contacted = set()
+        self._fan_out(hosts, self.exit_command, None, self.connect_timeout)
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+
+    def _start(self, host, argv, stdin, timeout):
+        proc = subprocess.Popen(argv(host),
+            stdin=subprocess.PIPE if stdin is not None else open(os.devnull),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
+        now = time.time()
+        job = {'host': host, 'proc': proc, 'start': now,
+               'deadline': now + timeout, 'out': [], 'err': [],
+               'stdin': stdin, 'offset': 0, 'fds': set(),
+               'stdin_fd': proc.stdin.fileno() if stdin is not None else None,
+               'stdout_fd': proc.stdout.fileno()}
+        for f in [proc.stdout, proc.stderr] + \
+                ([proc.stdin] if stdin is not None else []):
+            fl = fcntl.fcntl(f.fileno(), fcntl.F_GETFL)
+            fcntl.fcntl(f.fileno(), fcntl.F_SETFL, fl | os.O_NONBLOCK)
+            job['fds'].add(f.fileno())
+        return job
+
+    def _close(self, poller, fds, job, fd):
+        poller.unregister(fd)
+        del fds[fd]
+        job['fds'].discard(fd)
+        if fd == job['stdin_fd']:
+            job['stdin_fd'] = None
+        for f in [job['proc'].stdin, job['proc'].stdout, job['proc'].stderr]:
+            if f is not None and not f.closed and f.fileno() == fd:
+                f.close()
+
+    def _write(self, poller, fds, job, fd):
+        data = job['stdin']
+        try:
+            n = os.write(fd, data[job['offset']:job['offset'] + CHUNK])
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            # the command exited without reading all of stdin
+            n = len(data)
+        job['offset'] = job['offset'] + n
+        if job['offset'] >= len(data):
+            self._close(poller, fds, job, fd)
+
+    def _read(self, poller, fds, job, fd):
+        try:
+            data = os.read(fd, CHUNK)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            data = b''
+        if not data:
+            self._close(poller, fds, job, fd)
+        elif fd == job['stdout_fd']:
+            job['out'].append(data)
+        else:
+            job['err'].append(data)
+
+    def _result(self, job, timed_out=False):
+        proc = job['proc']
+        if timed_out:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+        exit_code = proc.wait()
+        return {'host': job['host'],
+                'exit': None if timed_out else exit_code,
+                'stdout': b''.join(job['out']).decode('utf-8', 'replace'),
+                'stderr': b''.join(job['err']).decode('utf-8', 'replace'),
+                'duration': time.time() - job['start'],
+                'timeout': timed_out}
+
+    def run(self, hosts, cmd, stdin=None, timeout=None, concurrency=None):
+        """
+        Runs cmd on every host, returns {host: result}. concurrency, when
+        lower, caps the sessions open at once for just this command.
+        """
+        hosts = list(hosts)
+        self.contacted.update(hosts)
+        return self._fan_out(hosts, lambda host: self.command(host, cmd),
+                             stdin, timeout or self.timeout,
+                             min(concurrency or self.concurrency,
+                                 self.concurrency))
+
+    def _fan_out(self, hosts, argv, stdin, timeout, concurrency=None):
+        concurrency = concurrency or self.concurrency
+        pending = list(hosts)
+        pending.reverse()
+        poller = select.poll()
+        fds = {}
+        jobs = []
+        results = {}
+        try:
+            while pending or jobs:
+                while pending and len(jobs) < concurrency:
+                    # with nothing of its own running a fan-out waits for a
+                    # session, otherwise it gets on with what it has
+                    if not SESSIONS.acquire(block=not jobs):
+                        break
+                    host = pending.pop()
+                    try:
+                        job = self._start(host, argv, stdin, timeout)
+                    except OSError as e:
+                        SESSIONS.release()
+                        results[host] = {'host': host, 'exit': None,
+                                         'stdout': '', 'stderr': str(e),
+                                         'duration': 0.0, 'timeout': False}
+                        continue
+                    jobs.append(job)
+                    for fd in job['fds']:
+                        fds[fd] = job
+                        poller.register(fd, select.POLLOUT
+                            if fd == job['stdin_fd'] else select.POLLIN)
+                if not jobs:
+                    # every host left failed to start, results has why
+                    continue
+                wait = min(j['deadline'] for j in jobs) - time.time()
+                if pending and len(jobs) < concurrency:
+                    # come back soon for a session another thread frees
+                    wait = min(wait, 0.1)
+                try:
+                    events = poller.poll(max(0, min(wait, 1.0)) * 1000)
+                except select.error as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                for fd, event in events:
+                    job = fds.get(fd)
+                    if job is None:
+                        continue
+                    if fd == job['stdin_fd']:
+                        if event & (select.POLLERR | select.POLLHUP):
+                            self._close(poller, fds, job, fd)
+                        else:
+                            self._write(poller, fds, job, fd)
+                    else:
+                        self._read(poller, fds, job, fd)
+                now = time.time()
+                for job in list(jobs):
+                    timed_out = job['fds'] and now >= job['deadline']
+                    if job['fds'] and not timed_out:
+                        continue
+                    for fd in list(job['fds']):
+                        self._close(poller, fds, job, fd)
+                    results[job['host']] = self._result(job, bool(timed_out))
+                    jobs.remove(job)
+                    SESSIONS.release()
+        finally:
+            # only left over when the loop raised
+            for job in jobs:
+                for fd in list(job['fds']):
+                    self._close(poller, fds, job, fd)
+                self._result(job, True)
+                SESSIONS.release()
+        return results
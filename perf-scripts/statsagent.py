@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Stats agent for load clients. Once per interval it sends the collector on
+the bootstrap host one small JSON datagram of cumulative counters:
+
+    {"seq": 12, "requests": 123456, "errors": 12, "procs": 16}
+
+requests is the number of TCP connections this host opened successfully
+(ab without keepalive opens one per request), errors counts failed connects
+and resets, procs is the number of running load generator processes.
+Counters are cumulative so a lost datagram costs nothing but resolution.
+"""
+import argparse, json, os, socket, time
+
+def tcp_counters():
+    with open('/proc/net/snmp') as f:
+        lines = [l.split() for l in f if l.startswith('Tcp:')]
+    stats = dict(zip(lines[0][1:], [int(v) for v in lines[1][1:]]))
+    errors = stats['AttemptFails'] + stats['EstabResets']
+    return stats['ActiveOpens'] - stats['AttemptFails'], errors
+
+def count_procs(names):
+    n = 0
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/%s/comm' % pid) as f:
+                if f.read().strip() in names:
+                    n = n + 1
+        except IOError:
+            pass
+    return n
+
+def main():
+    parser = argparse.ArgumentParser(description='Load client stats agent')
+    parser.add_argument('--collector', required=True,
+                        help='collector address as ip:port')
+    parser.add_argument('--interval', type=float, default=1.0)
+    parser.add_argument('--duration', type=float, default=0,
+                        help='seconds to run, 0 runs until killed')
+    parser.add_argument('--procs', default='ab',
+                        help='comma separated load generator process names')
+    args = parser.parse_args()
+
+    ip, port = args.collector.split(':')
+    collector = (ip, int(port))
+    names = set(args.procs.split(','))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    end = time.time() + args.duration if args.duration else None
+    seq = 0
+    while end is None or time.time() < end:
+        requests, errors = tcp_counters()
+        msg = {'seq': seq, 'requests': requests, 'errors': errors,
+               'procs': count_procs(names)}
+        try:
+            sock.sendto(json.dumps(msg).encode(), collector)
+        except socket.error:
+            pass
+        seq = seq + 1
+        time.sleep(args.interval)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+TLS load generator. Runs one asyncio worker process per core, each with a
+number of concurrent connections to the VIP, in one of three modes:
+
+  handshake  a full TLS handshake for every request
+  resume     every request on a new connection resuming the last session
+  keepalive  requests back to back on long lived connections
+
+Latency (connect to end of response) goes into a log-linear histogram per
+worker. With --collector the parent streams cumulative counters to the
+watchtest aggregator every --interval. On exit (duration over, SIGINT or
+SIGTERM) it prints one line, {"tlsload": summary}, that results.py merges
+exactly across processes and clients.
+
+--serve runs a small TLS HTTP server instead, for benchmarking locally:
+
+  openssl req -x509 -newkey rsa:2048 -nodes -subj /CN=localhost \\
+      -keyout key.pem -out cert.pem
+  ./tlsload.py --serve --port 8443 --cert cert.pem --key key.pem &
+  ./tlsload.py --url https://127.0.0.1:8443/ --duration 10
+"""
+import argparse, asyncio, json, multiprocessing, os, queue, signal, socket
+import ssl, time
+from urllib.parse import urlparse
+
+import histogram
+
+class Stats(object):
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.handshakes = 0
+        self.resumed = 0
+        self.hist = {}
+        self.running = True
+
+    def snapshot(self):
+        return {'requests': self.requests, 'errors': self.errors,
+                'handshakes': self.handshakes, 'resumed': self.resumed,
+                'hist': dict(self.hist)}
+
+class TLSConnection(object):
+    """
+    TLS over an asyncio stream through memory BIOs. Unlike asyncio's own
+    TLS transport this can pass a session to resume.
+    """
+    def __init__(self, reader, writer, ctx, server_hostname, session=None):
+        self.reader = reader
+        self.writer = writer
+        self.incoming = ssl.MemoryBIO()
+        self.outgoing = ssl.MemoryBIO()
+        self.sslobj = ctx.wrap_bio(self.incoming, self.outgoing,
+                                   server_hostname=server_hostname,
+                                   session=session)
+
+    @classmethod
+    async def open(cls, host, port, ctx, server_hostname, session=None):
+        reader, writer = await asyncio.open_connection(host, port)
+        conn = cls(reader, writer, ctx, server_hostname, session)
+        try:
+            await conn._io(conn.sslobj.do_handshake)
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    async def _flush(self):
+        data = self.outgoing.read()
+        if data:
+            self.writer.write(data)
+            await self.writer.drain()
+
+    async def _io(self, op, *args):
+        while True:
+            try:
+                res = op(*args)
+                await self._flush()
+                return res
+            except ssl.SSLWantReadError:
+                await self._flush()
+                data = await self.reader.read(65536)
+                if not data:
+                    raise ConnectionError('connection closed during TLS')
+                self.incoming.write(data)
+
+    async def send(self, data):
+        await self._io(self.sslobj.write, data)
+
+    async def recv(self):
+        try:
+            return await self._io(self.sslobj.read, 65536)
+        except (ssl.SSLZeroReturnError, ConnectionError):
+            return b''
+
+    def close(self):
+        self.writer.close()
+
+async def read_response(conn):
+    """Reads one response, returns (status, keepalive)."""
+    buf = b''
+    while b'\r\n\r\n' not in buf:
+        data = await conn.recv()
+        if not data:
+            raise ConnectionError('connection closed before response')
+        buf = buf + data
+    head, body = buf.split(b'\r\n\r\n', 1)
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        k, _, v = line.partition(':')
+        headers[k.strip().lower()] = v.strip().lower()
+    keepalive = headers.get('connection') != 'close'
+    if 'content-length' in headers:
+        left = int(headers['content-length']) - len(body)
+        while left > 0:
+            data = await conn.recv()
+            if not data:
+                raise ConnectionError('connection closed in body')
+            left = left - len(data)
+    else:
+        # no length, the body ends when the server closes
+        while await conn.recv():
+            pass
+        keepalive = False
+    return status, keepalive
+
+async def client_loop(args, target, ctx, stats):
+    host, port, path = target
+    keepalive = args.mode == 'keepalive'
+    request = ('GET %s HTTP/1.1\r\nHost: %s\r\nConnection: %s\r\n\r\n' % (
+        path, host, 'keep-alive' if keepalive else 'close')).encode()
+    session = None
+    conn = None
+    while stats.running:
+        start = time.monotonic()
+        try:
+            if conn is None:
+                conn = await asyncio.wait_for(TLSConnection.open(host, port,
+                    ctx, args.sni or host, session), args.timeout)
+                stats.handshakes += 1
+                if conn.sslobj.session_reused:
+                    stats.resumed += 1
+            await conn.send(request)
+            status, alive = await asyncio.wait_for(read_response(conn),
+                                                   args.timeout)
+            if args.mode == 'resume':
+                session = conn.sslobj.session
+            if status >= 400:
+                stats.errors += 1
+            else:
+                stats.requests += 1
+                histogram.record(stats.hist,
+                                 (time.monotonic() - start) * 1000000)
+            if not (keepalive and alive):
+                conn.close()
+                conn = None
+        except asyncio.CancelledError:
+            if conn:
+                conn.close()
+            raise
+        except Exception:
+            stats.errors += 1
+            if conn:
+                conn.close()
+            conn = None
+            # don't spin on a VIP that refuses connections
+            await asyncio.sleep(0.01)
+
+async def run_worker(args, target, results, stop):
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    if args.max_tls == '1.2':
+        ctx.options |= getattr(ssl, 'OP_NO_TLSv1_3', 0)
+    if args.ciphers:
+        ctx.set_ciphers(args.ciphers)
+    stats = Stats()
+    tasks = [asyncio.ensure_future(client_loop(args, target, ctx, stats))
+             for _ in range(args.concurrency)]
+    while not stop.is_set():
+        await asyncio.sleep(args.interval)
+        results.put(('tick', os.getpid(), stats.snapshot()))
+    # wait_for can swallow a cancel that races with its result, so the
+    # loops also check running and stragglers get one timeout to finish
+    stats.running = False
+    for t in tasks:
+        t.cancel()
+    await asyncio.wait(tasks, timeout=args.timeout)
+    results.put(('final', os.getpid(), stats.snapshot()))
+
+def worker_main(args, target, results, stop):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    # no asyncio.run, CentOS 7 clients have python 3.6
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(run_worker(args, target, results, stop))
+
+def summarize(snaps, elapsed):
+    hist = histogram.merge(s['hist'] for s in snaps)
+    summary = {'requests': sum(s['requests'] for s in snaps),
+               'errors': sum(s['errors'] for s in snaps),
+               'handshakes': sum(s['handshakes'] for s in snaps),
+               'resumed': sum(s['resumed'] for s in snaps),
+               'time': elapsed, 'hist': hist}
+    summary['rps'] = summary['requests'] / elapsed if elapsed else 0.0
+    summary['latency'] = histogram.percentiles(hist)
+    return summary
+
+def run_load(args):
+    url = urlparse(args.url)
+    target = (url.hostname, url.port or 443, url.path or '/')
+    results = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    workers = [multiprocessing.Process(target=worker_main,
+                                       args=(args, target, results, stop))
+               for _ in range(args.workers)]
+    for w in workers:
+        w.start()
+
+    def _stop(signum, frame):
+        stop.set()
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+
+    sock = None
+    if args.collector:
+        ip, port = args.collector.split(':')
+        collector = (ip, int(port))
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    start = time.time()
+    end = start + args.duration if args.duration else None
+    latest = {}
+    finals = {}
+    seq = 0
+    while len(finals) < len(workers):
+        if end and time.time() >= end:
+            stop.set()
+        try:
+            kind, pid, snap = results.get(timeout=args.interval)
+        except queue.Empty:
+            if not any(w.is_alive() for w in workers):
+                break
+            continue
+        except InterruptedError:
+            continue
+        if kind == 'final':
+            finals[pid] = snap
+        latest[pid] = snap
+        if sock and kind == 'tick' and len(latest) == len(workers):
+            # one datagram per round of worker ticks, as statsagent sends
+            snaps = list(latest.values())
+            msg = {'seq': seq, 'procs': len(workers),
+                   'requests': sum(s['requests'] for s in snaps),
+                   'errors': sum(s['errors'] for s in snaps),
+                   'lat': histogram.coarse(histogram.merge(
+                       s['hist'] for s in snaps))}
+            seq = seq + 1
+            latest = {}
+            try:
+                sock.sendto(json.dumps(msg).encode(), collector)
+            except OSError:
+                pass
+    for w in workers:
+        w.join()
+    summary = summarize(list(finals.values()), time.time() - start)
+    print(json.dumps({'tlsload': summary}), flush=True)
+
+async def handle_client(reader, writer):
+    try:
+        while True:
+            head = await reader.readuntil(b'\r\n\r\n')
+            close = b'connection: close' in head.lower()
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n'
+                         b'Connection: ' + (b'close' if close else
+                                            b'keep-alive') + b'\r\n\r\n')
+            await writer.drain()
+            if close:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError):
+        pass
+    finally:
+        writer.close()
+
+def serve_main(args):
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(args.cert, args.key)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(asyncio.start_server(handle_client, args.host,
+        args.port, ssl=ctx, reuse_port=True, backlog=4096))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+def serve(args):
+    workers = [multiprocessing.Process(target=serve_main, args=(args,))
+               for _ in range(args.workers)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+def main():
+    parser = argparse.ArgumentParser(description='TLS load generator')
+    parser.add_argument('--url', help='target, e.g. https://10.0.0.1/')
+    parser.add_argument('--mode', default='handshake',
+                        choices=['handshake', 'resume', 'keepalive'])
+    parser.add_argument('--workers', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='worker processes, one per core by default')
+    parser.add_argument('--concurrency', type=int, default=100,
+                        help='concurrent connections per worker')
+    parser.add_argument('--duration', type=float, default=0,
+                        help='seconds to run, 0 runs until interrupted')
+    parser.add_argument('--timeout', type=float, default=10,
+                        help='per connect and per response timeout')
+    parser.add_argument('--sni', help='server name to send, url host by default')
+    parser.add_argument('--max-tls', choices=['1.2', '1.3'], default='1.3')
+    parser.add_argument('--ciphers', help='OpenSSL cipher list')
+    parser.add_argument('--collector', help='watchtest collector ip:port')
+    parser.add_argument('--interval', type=float, default=1.0)
+    parser.add_argument('--serve', action='store_true',
+                        help='run a local TLS server instead')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--cert', help='server certificate for --serve')
+    parser.add_argument('--key', help='server key for --serve')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+    elif args.url:
+        run_load(args)
+    else:
+        parser.error('one of --url or --serve is required')
+
+if __name__ == '__main__':
+    main()
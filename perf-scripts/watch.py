@@ -0,0 +1,158 @@
+import json, numbers, select, socket, time
+from collections import deque
+from histogram import LATENCY_BUCKETS_MS
+
+def latency_percentile(buckets, pct):
+    """Upper bound of the bucket holding the pct percentile, None if empty."""
+    total = sum(buckets)
+    if not total:
+        return None
+    rank = total * pct / 100.0
+    seen = 0
+    for i, n in enumerate(buckets):
+        seen = seen + n
+        if seen >= rank:
+            break
+    if i < len(LATENCY_BUCKETS_MS):
+        return LATENCY_BUCKETS_MS[i]
+    return float('inf')
+
+def window_rates(before, after):
+    """
+    Fleet tps, error rate and p99 between two totals() of an aggregator.
+    Only hosts reporting at both ends without restarting in between count.
+    """
+    requests = errors = 0
+    elapsed = []
+    lat = None
+    for host, (t1, last) in after.items():
+        if host not in before:
+            continue
+        t0, first = before[host]
+        if t1 <= t0 or last['requests'] < first['requests']:
+            continue
+        requests = requests + last['requests'] - first['requests']
+        errors = errors + last['errors'] - first['errors']
+        elapsed.append(t1 - t0)
+        if 'lat' in last and 'lat' in first:
+            delta = [b - a for a, b in zip(first['lat'], last['lat'])]
+            lat = delta if lat is None else [a + b for a, b in zip(lat, delta)]
+    # hosts report on their own clocks, the mean interval is close enough
+    span = sum(elapsed) / len(elapsed) if elapsed else 0
+    total = requests + errors
+    return {'reporting': len(elapsed),
+            'tps': requests / float(span) if span else 0.0,
+            'error_rate': float(errors) / total if total else 0.0,
+            'p99': latency_percentile(lat, 99) if lat else None}
+
+class StatsAggregator(object):
+    """
+    Receives the datagrams statsagent.py (or a load generator) sends from
+    each client and rolls them up into a fleet view. Per host it keeps the
+    last few samples of cumulative counters, so rates are deltas over a
+    short window and a lost datagram only costs resolution.
+    """
+    def __init__(self, port, log, window=5, stale=5):
+        self.log = log
+        self.window = window
+        self.stale = stale
+        self.hosts = {}
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('0.0.0.0', port))
+
+    def close(self):
+        self.sock.close()
+
+    def _receive(self, timeout):
+        end = time.time() + timeout
+        while True:
+            left = end - time.time()
+            if left <= 0:
+                return
+            r, _, _ = select.select([self.sock], [], [], left)
+            if not r:
+                return
+            data, addr = self.sock.recvfrom(65535)
+            try:
+                msg = json.loads(data)
+            except ValueError:
+                continue
+            # the StatsD port gets other senders' datagrams too
+            if not isinstance(msg, dict) or not all(
+                    isinstance(msg.get(k), numbers.Number)
+                    for k in ('requests', 'errors')):
+                continue
+            samples = self.hosts.setdefault(addr[0],
+                                            deque(maxlen=self.window + 1))
+            if samples and msg['requests'] < samples[-1][1]['requests']:
+                # the agent restarted, its counters did too
+                samples.clear()
+            samples.append((time.time(), msg))
+
+    def totals(self):
+        """Latest (time, counters) of every host still reporting."""
+        now = time.time()
+        return dict((host, samples[-1]) for host, samples in self.hosts.items()
+                    if now - samples[-1][0] <= self.stale)
+
+    def snapshot(self, slowest=5):
+        """
+        Fleet view over the last window: total tps, error rate, p99 when
+        clients report latency buckets, and the slowest clients.
+        """
+        now = time.time()
+        view = {'clients': 0, 'stale': [], 'tps': 0.0, 'errors': 0.0,
+                'procs': 0, 'p99': None, 'slowest': []}
+        lat = None
+        rates = []
+        for host, samples in self.hosts.items():
+            if now - samples[-1][0] > self.stale:
+                view['stale'].append(host)
+                continue
+            view['clients'] = view['clients'] + 1
+            view['procs'] = view['procs'] + samples[-1][1].get('procs', 0)
+            if len(samples) < 2:
+                continue
+            (t0, first), (t1, last) = samples[0], samples[-1]
+            tps = (last['requests'] - first['requests']) / (t1 - t0)
+            view['tps'] = view['tps'] + tps
+            view['errors'] = view['errors'] + \
+                (last['errors'] - first['errors']) / (t1 - t0)
+            rates.append((tps, host))
+            if 'lat' in last and 'lat' in first:
+                delta = [b - a for a, b in zip(first['lat'], last['lat'])]
+                lat = delta if lat is None else \
+                    [a + b for a, b in zip(lat, delta)]
+        if lat:
+            view['p99'] = latency_percentile(lat, 99)
+        view['slowest'] = [(h, t) for t, h in sorted(rates)[:slowest]]
+        return view
+
+    def format(self, view):
+        total = view['tps'] + view['errors']
+        err_pct = 100.0 * view['errors'] / total if total else 0.0
+        line = '%s clients %d procs %d tps %.0f errors %.2f%%' % (
+            time.strftime('%H:%M:%S'), view['clients'], view['procs'],
+            view['tps'], err_pct)
+        if view['p99'] is not None:
+            line = line + ' p99<=%sms' % view['p99']
+        if view['slowest']:
+            line = line + ' slowest ' + ' '.join('%s:%.0f' % s
+                                                 for s in view['slowest'])
+        if view['stale']:
+            line = line + ' silent %d' % len(view['stale'])
+        return line
+
+    def run(self, duration=0, interval=1.0):
+        """
+        Logs the fleet view every interval until duration seconds have
+        passed, or forever when duration is 0. Returns the last view.
+        """
+        end = time.time() + duration if duration else None
+        view = None
+        while end is None or time.time() < end:
+            self._receive(interval)
+            view = self.snapshot()
+            self.log.info(self.format(view))
+        return view